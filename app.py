@@ -1,45 +1,124 @@
 #!/usr/bin/env python
 
-# local imports
-import modules.admin as admin
-import modules.irc as irc
-import modules.paste as paste
-import modules.sanity as sanity
-import modules.utils as utils
-
-import bottle
 import configparser
-import redis
 
 # Load Settings
 conf = configparser.ConfigParser({
     'cache_host': 'localhost',
+    'cache_port': 6379,
+    'cache_socket': '',
+    'cache_password': '',
     'cache_db': 0,
+    'cache_pool_size': 50,
+    'cache_connect_timeout': 1,
+    'cache_timeout': 5,
+    'cache_replica_host': '',
+    'cache_replica_port': 6379,
     'cache_ttl': 360,
     'port': 80,
     'root_path': '.',
     'url': '',
     'relay_enabled': True,
     'relay_chan': '',
+    'relay_host': '',
     'relay_port': 5050,
     'relay_pass': 'nil',
+    'relay_queue_size': 1000,
     'recaptcha_sitekey': '',
     'recaptcha_secret': '',
+    'recaptcha_url': 'https://www.google.com/recaptcha/api/siteverify',
+    'recaptcha_connect_timeout': 2,
+    'recaptcha_timeout': 5,
+    'recaptcha_fail_open': False,
+    'recaptcha_pool_size': 10,
     'check_spam': False,
     'admin_key': '',
-    'python_server': 'auto'})
+    'cache_max_age': 300,
+    'proxy_cache_ttl': 0,
+    'purge_url': '',
+    'purge_method': 'PURGE',
+    'purge_by_key': False,
+    'purge_file': '',
+    'max_upload': 102400,
+    'subnet_file': '',
+    'subnet_cache_size': 4096,
+    'subnet_cache_ttl': 3600,
+    'whois_fallback': True,
+    'list_filter': False,
+    'prerender_workers': 2,
+    'python_server': 'auto',
+    'metrics_enabled': False,
+    'ratelimit_post': '20/60',
+    'ratelimit_view': '',
+    'ratelimit_diff': '60/60'})
 conf.read('conf/settings.cfg')
 
+# gevent has to patch the standard library before anything else imports it,
+# so that Redis, whois, recaptcha and relay sockets yield instead of blocking
+if conf.get('bottle', 'python_server') == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+
+# local imports
+import modules.admin as admin
+import modules.assets as assets
+import modules.caching as caching
+import modules.captcha as captcha
+import modules.diff as diff
+import modules.irc as irc
+import modules.metrics as metrics
+import modules.paste as paste
+import modules.ratelimit as ratelimit
+import modules.render as render
+import modules.sanity as sanity
+import modules.store as store
+import modules.utils as utils
+
+import bottle
+
 app = application = bottle.Bottle()
-cache = redis.StrictRedis(host=conf.get('bottle', 'cache_host'), db=int(conf.get('bottle', 'cache_db')))
+metrics.configure(conf)
+cache = store.connect(conf)
+static_files = assets.Manifest('{}/static'.format(conf.get('bottle', 'root_path')))
+static_files.add('css/code.css', paste.get_style())
+bottle.BaseTemplate.defaults['asset'] = static_files.url
+page_version = caching.page_version(conf.get('bottle', 'root_path'), static_files.version())
+sanity.configure(conf, cache)
+irc.configure(conf)
+captcha.configure(conf)
+render.configure(conf)
+ratelimit.configure(conf)
+
+
+def redis_guard(callback):
+    '''
+    Answer with 503 instead of a stack trace when Redis is unreachable.
+    '''
+    def wrapper(*args, **kwargs):
+        try:
+            return callback(*args, **kwargs)
+        except store.UNAVAILABLE as e:
+            print('Redis unavailable: {}'.format(e))
+            body = bottle.jinja2_template('error.html', code=503,
+                                          message='Temporarily unavailable, please try again shortly. ERR:503')
+            return bottle.HTTPResponse(body, status=503, headers={'Retry-After': '5'})
+    return wrapper
+
+
+app.install(redis_guard)
+app.install(metrics.Plugin())
+metrics.register('pbin_relay_messages_total', 'counter', 'Messages handled by the IRC relay.',
+                 lambda: [({'result': k}, v) for (k, v) in irc.stats().items() if k != 'depth'])
+metrics.register('pbin_relay_queue_depth', 'gauge', 'Messages waiting for the IRC relay.',
+                 lambda: [({}, irc.stats()['depth'])])
 
 
 @app.route('/static/<filename:path>')
 def static(filename):
     '''
-    Serve static files
+    Serve static files from memory
     '''
-    return bottle.static_file(filename, root='{}/static'.format(conf.get('bottle', 'root_path')))
+    return static_files.serve(filename)
 
 
 @app.error(500)
@@ -66,6 +145,7 @@ def new_fork(paste_id):
     Display page for new fork from a paste
     '''
     (data, template) = paste.new_paste(conf, cache, paste_id)
+    bottle.response.set_header('Surrogate-Key', caching.surrogate_keys([paste_id]))
     return bottle.jinja2_template('paste.html', data=data, tmpl=template)
 
 
@@ -74,6 +154,7 @@ def submit_paste():
     '''
     Put a new paste into the database
     '''
+    ratelimit.check(cache, 'post')
     return paste.submit_new(conf, cache)
 
 
@@ -82,8 +163,11 @@ def view_paste(paste_id):
     '''
     Return page with <paste_id>.
     '''
-    data = paste.get_paste(cache, paste_id)
-    return bottle.jinja2_template('view.html', paste=data, pid=paste_id)
+    ratelimit.check(cache, 'view')
+    encoding = assets.negotiate(bottle.request.get_header('Accept-Encoding', ''), assets.ENCODINGS)
+    caching.check_pastes(conf, cache, [paste_id], 'v' + page_version, encoding)
+    (body, encoding) = paste.get_page(cache, paste_id, page_version, encoding)
+    return caching.send_encoded(body, encoding)
 
 
 @app.route('/r/<paste_id>')
@@ -91,9 +175,10 @@ def view_raw(paste_id):
     '''
     View raw paste with <paste_id>.
     '''
-    data = paste.get_paste(cache, paste_id, raw=True)
-    bottle.response.add_header('Content-Type', 'text/plain; charset=utf-8')
-    return data['code']
+    encoding = assets.negotiate(bottle.request.get_header('Accept-Encoding', ''), ('deflate',))
+    caching.check_pastes(conf, cache, [paste_id], 'r', encoding)
+    (body, encoding) = paste.get_raw(cache, paste_id, encoding == 'deflate')
+    return caching.send_encoded(body, encoding, 'text/plain; charset=utf-8')
 
 
 @app.route('/d/<orig>/<fork>')
@@ -101,12 +186,18 @@ def view_diff(orig, fork):
     '''
     View the diff between a paste and what it was forked from
     '''
-    if not cache.exists('paste:' + orig) or not cache.exists('paste:' + fork):
+    ratelimit.check(cache, 'diff')
+    # Optionally only show this many unchanged lines around each change
+    context = bottle.request.query.get('context', '')
+    context = min(int(context), diff.MAX_CONTEXT) if context.isdigit() else None
+    variant = 'd{}.{}'.format(page_version, 'full' if context is None else context)
+    caching.check_pastes(conf, cache, [orig, fork], variant)
+    table = paste.gen_diff(cache, orig, fork, context)
+    if table is None:
         return bottle.jinja2_template('error.html', code=200,
                                       message='At least one paste could not be found.')
 
-    diff = paste.gen_diff(cache, orig, fork)
-    return bottle.jinja2_template('page.html', data=diff)
+    return bottle.jinja2_template('page.html', data=table)
 
 
 @app.post('/admin')
@@ -114,6 +205,19 @@ def exec_admin():
     return admin.run_cmd(conf, cache)
 
 
+@app.route('/metrics')
+def show_metrics():
+    '''
+    Metrics in the Prometheus text format, for holders of the admin key
+    '''
+    if not metrics.enabled():
+        bottle.abort(404)
+    if not admin.bearer_authorized(conf):
+        return bottle.HTTPResponse('Invalid auth.\n', status=403)
+    bottle.response.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+    return metrics.exposition()
+
+
 @app.route('/about')
 def show_info():
     return bottle.jinja2_template('about.html')
@@ -121,5 +225,6 @@ def show_info():
 
 if __name__ == '__main__':
     app.run(
+        server=conf.get('bottle', 'python_server'),
         host='0.0.0.0',
         port=conf.getint('bottle', 'port'))
@@ -0,0 +1,328 @@
+#!/usr/bin/env python
+'''
+Benchmark every route of app.py in-process, plus the helpers behind them.
+
+The app runs against a local redis-server (database 15 by default, see
+--redis-*) or against fakeredis with --fakeredis (needs the fakeredis and
+lupa packages). whois, recaptcha and irccat are replaced by local stubs.
+Results are written as JSON; pass an earlier result as --baseline to fail
+on regressions.
+
+    python benchmarks/bench_app.py [--requests 200] [--concurrency 1] [--output run.json]
+    python benchmarks/bench_app.py --baseline run.json [--tolerance 0.2]
+'''
+
+import argparse
+import concurrent.futures
+import functools
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.parse
+import wsgiref.util
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+
+import bottle  # noqa: E402
+import cymruwhois  # noqa: E402
+
+from modules import paste  # noqa: E402
+from modules import store  # noqa: E402
+from modules import syntax  # noqa: E402
+
+import corpus  # noqa: E402
+import stubs  # noqa: E402
+
+# Sent with every request, as a browser would
+ACCEPT_ENCODING = 'gzip, deflate, br'
+
+
+def load_app(args, stub_delay=0, **overrides):
+    '''
+    Import app.py with settings pointing at the stubs, which answer after
+    stub_delay seconds; overrides are further settings.
+    Returns (app module, irccat stub).
+    '''
+    workdir = tempfile.mkdtemp(prefix='pbin-bench-')
+    os.mkdir(os.path.join(workdir, 'conf'))
+    irccat = stubs.irccat()
+    settings = {
+        'root_path': os.path.abspath(ROOT),
+        'url': 'http://bench.invalid/',
+        'cache_host': args.redis_host,
+        'cache_port': args.redis_port,
+        'cache_socket': args.redis_socket,
+        'cache_db': args.redis_db,
+        'relay_enabled': 'True',
+        'relay_host': irccat.server_address[0],
+        'relay_port': irccat.server_address[1],
+        'relay_chan': 'bench',
+        'check_spam': 'True',
+        'recaptcha_sitekey': 'bench',
+        'recaptcha_secret': 'bench',
+        'recaptcha_url': stubs.captcha(stub_delay),
+        'whois_fallback': 'True',
+        'prerender_workers': args.prerender_workers,
+        # Measure the routes, not 429s
+        'ratelimit_post': '',
+        'ratelimit_view': '',
+        'ratelimit_diff': ''}
+    settings.update(overrides)
+    with open(os.path.join(workdir, 'conf', 'settings.cfg'), 'w') as f:
+        f.write('[bottle]\n')
+        f.write(''.join('{}={}\n'.format(k, v) for (k, v) in settings.items()))
+
+    (whois_host, whois_port) = stubs.whois(stub_delay)
+    cymruwhois.Client = functools.partial(cymruwhois.Client, host=whois_host, port=whois_port)
+    if args.fakeredis:
+        import fakeredis
+        server = fakeredis.FakeServer()
+        store.connect = lambda conf: fakeredis.FakeStrictRedis(server=server)
+
+    # app.py reads conf/settings.cfg from the working directory
+    os.chdir(workdir)
+    bottle.TEMPLATE_PATH.insert(0, os.path.join(os.path.abspath(ROOT), 'views'))
+    import app
+    return (app, irccat)
+
+
+def request(app, method, path, form=None, headers=None, addr='127.0.0.1'):
+    '''
+    Call the wsgi app directly.
+    Returns (status, headers, body).
+    '''
+    environ = {}
+    wsgiref.util.setup_testing_defaults(environ)
+    (path, _, query) = path.partition('?')
+    environ.update({
+        'REQUEST_METHOD': method,
+        'PATH_INFO': path,
+        'QUERY_STRING': query,
+        'REMOTE_ADDR': addr,
+        'HTTP_ACCEPT_ENCODING': ACCEPT_ENCODING})
+    for (name, value) in (headers or {}).items():
+        environ['HTTP_' + name.upper().replace('-', '_')] = value
+    body = b''
+    if form is not None:
+        body = urllib.parse.urlencode(form).encode('utf-8')
+        environ['CONTENT_TYPE'] = 'application/x-www-form-urlencoded'
+    environ['CONTENT_LENGTH'] = str(len(body))
+    environ['wsgi.input'] = io.BytesIO(body)
+
+    response = []
+
+    def start_response(status, response_headers, exc_info=None):
+        response.append((int(status.split()[0]), dict(response_headers)))
+
+    body = b''.join(app(environ, start_response))
+    return (response[0][0], response[0][1], body)
+
+
+def measure(name, func, count, concurrency=1, **labels):
+    '''
+    Time count calls of func; the first, cold call is reported on its own.
+    func returns True on success.
+    '''
+    start = time.perf_counter()
+    ok = func(0)
+    cold = time.perf_counter() - start
+    errors = 0 if ok else 1
+
+    def timed(n):
+        start = time.perf_counter()
+        ok = func(n)
+        return (time.perf_counter() - start, ok)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(timed, range(1, count + 1)))
+    wall = time.perf_counter() - start
+
+    latencies = sorted(t for (t, _) in results)
+    errors += sum(1 for (_, ok) in results if not ok)
+    result = dict(labels, name=name, count=count, concurrency=concurrency, errors=errors,
+                  rps=round(count / wall, 1),
+                  cold_ms=round(cold * 1000, 3),
+                  p50_ms=round(_percentile(latencies, 50) * 1000, 3),
+                  p99_ms=round(_percentile(latencies, 99) * 1000, 3))
+    print('{:<28} {:<8} {:<7} {:>9.1f}/s p50 {:>9.3f}ms p99 {:>9.3f}ms cold {:>9.3f}ms{}'.format(
+            name, labels.get('syntax', ''), labels.get('size', ''), result['rps'],
+            result['p50_ms'], result['p99_ms'], result['cold_ms'],
+            '  ({} errors)'.format(errors) if errors else ''), file=sys.stderr)
+    return result
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def _address(n):
+    # Spread posts over a few hundred subnets so the subnet cache and whois both see use
+    return '10.{}.{}.{}'.format(n % 7, n % 251, n % 254 + 1)
+
+
+def bench_routes(app, cache, args):
+    results = []
+    count = args.requests
+    conc = args.concurrency
+
+    def get(path, expect=(200,), headers=None):
+        return lambda n: request(app.app, 'GET', path, headers=headers)[0] in expect
+
+    results.append(measure('GET /', get('/'), count, conc))
+
+    for syntax_name in args.syntaxes:
+        for size in args.sizes:
+            code = corpus.make_code(syntax_name, size)
+            if size != 'huge':
+                for (kind, webform) in (('web', '1'), ('cli', '')):
+                    form = {'code': code, 'name': 'bench', 'private': '0', 'syntax': syntax_name,
+                            'webform': webform, 'g-recaptcha-response': 'bench' if webform else ''}
+
+                    def post(n, form=form):
+                        status = request(app.app, 'POST', '/', form=form, addr=_address(n))[0]
+                        return status in (200, 302, 303)
+                    results.append(measure('POST / ' + kind, post, count, conc,
+                                           syntax=syntax_name, size=size))
+
+            # Huge pastes are over the post size limit, so write them directly
+            data = {'code': code, 'name': 'bench', 'private': '0', 'syntax': syntax_name,
+                    'recaptcha_answer': 'bench'}
+            orig = paste._write_paste(cache, data)
+            fork = paste._write_paste(cache, dict(data, code=corpus.make_fork(code), forked_from=orig))
+
+            labels = {'syntax': syntax_name, 'size': size}
+            results.append(measure('GET /<id>', get('/' + fork), count, conc, **labels))
+            tag = request(app.app, 'GET', '/' + fork)[1].get('ETag')
+            if tag:
+                results.append(measure('GET /<id> revalidate', get('/' + fork, (304,), {'If-None-Match': tag}),
+                                       count, conc, **labels))
+            results.append(measure('GET /r/<id>', get('/r/' + fork), count, conc, **labels))
+            results.append(measure('GET /f/<id>', get('/f/' + fork), count, conc, **labels))
+            results.append(measure('GET /d/<a>/<b>', get('/d/{}/{}'.format(orig, fork)), count, conc, **labels))
+    return results
+
+
+def bench_helpers(cache, args):
+    results = []
+    rounds = args.rounds
+
+    for syntax_name in args.syntaxes:
+        for size in args.sizes:
+            code = corpus.make_code(syntax_name, size)
+            labels = {'syntax': syntax_name, 'size': size}
+
+            def highlight(n, code=code, syntax_name=syntax_name):
+                return bool(syntax.render(code, syntax_name))
+            results.append(measure('syntax.render', highlight, rounds, **labels))
+
+            data = {'code': code, 'name': 'bench', 'private': '0', 'syntax': syntax_name,
+                    'recaptcha_answer': 'bench'}
+
+            def write(n, data=data):
+                return bool(paste._write_paste(cache, data))
+            results.append(measure('paste._write_paste', write, rounds, **labels))
+
+            orig = paste._write_paste(cache, data)
+            fork = paste._write_paste(cache, dict(data, code=corpus.make_fork(code)))
+
+            def gen_diff(n, orig=orig, fork=fork):
+                # Drop the cached copy so every round computes the diff
+                cache.delete('diff:{}:{}:full'.format(orig, fork))
+                return paste.gen_diff(cache, orig, fork) is not None
+            results.append(measure('paste.gen_diff', gen_diff, rounds, **labels))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Print results whose median got slower than the baseline by more than tolerance.
+    Returns the number of regressions.
+    '''
+    def key(r):
+        return (r['name'], r.get('syntax', ''), r.get('size', ''), r.get('concurrency', 1))
+    previous = {key(r): r for r in baseline['results']}
+    regressions = 0
+    for result in results:
+        old = previous.get(key(result))
+        if old is None or not old['p50_ms']:
+            continue
+        change = result['p50_ms'] / old['p50_ms'] - 1
+        if change > tolerance:
+            regressions += 1
+            print('REGRESSION {} {} {}: p50 {:.3f}ms -> {:.3f}ms ({:+.0%})'.format(
+                    *key(result)[:3], old['p50_ms'], result['p50_ms'], change), file=sys.stderr)
+    return regressions
+
+
+def _revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=200, help='requests per route and paste')
+    parser.add_argument('--concurrency', type=int, default=1, help='threads issuing requests')
+    parser.add_argument('--rounds', type=int, default=20, help='calls per helper benchmark')
+    parser.add_argument('--syntaxes', default=','.join(corpus.SYNTAXES))
+    parser.add_argument('--sizes', default=','.join(corpus.SIZES))
+    parser.add_argument('--only', choices=('routes', 'helpers'))
+    parser.add_argument('--redis-host', default='localhost')
+    parser.add_argument('--redis-port', type=int, default=6379)
+    parser.add_argument('--redis-socket', default='')
+    parser.add_argument('--redis-db', type=int, default=15)
+    parser.add_argument('--fakeredis', action='store_true', help='use fakeredis instead of a redis-server')
+    parser.add_argument('--prerender-workers', type=int, default=0)
+    parser.add_argument('--output', help='write results here instead of stdout')
+    parser.add_argument('--baseline', help='earlier results to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='allowed slowdown of the median before failing')
+    args = parser.parse_args()
+    args.syntaxes = args.syntaxes.split(',')
+    args.sizes = args.sizes.split(',')
+    # load_app() changes the working directory
+    args.output = args.output and os.path.abspath(args.output)
+    args.baseline = args.baseline and os.path.abspath(args.baseline)
+
+    (app, irccat) = load_app(args)
+    results = []
+    if args.only != 'helpers':
+        results.extend(bench_routes(app, app.cache, args))
+    if args.only != 'routes':
+        results.extend(bench_helpers(app.cache, args))
+
+    report = {
+        'meta': {
+            'revision': _revision(),
+            'time': int(time.time()),
+            'python': platform.python_version(),
+            'redis': 'fakeredis' if args.fakeredis else 'redis-server',
+            'relayed_lines': irccat.lines},
+        'results': results}
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            if compare(results, json.load(f), args.tolerance):
+                sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+'''
+Compare modules.diff against difflib.HtmlDiff on generated config pastes.
+
+    python benchmarks/bench_diff.py [--sizes 1000,10000,100000] [--htmldiff-max 10000]
+'''
+
+import argparse
+import difflib
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from modules import diff  # noqa: E402
+
+
+def make_pair(lines, seed=0):
+    '''
+    Returns an nginx-like config and a copy with about 1% of lines edited.
+    '''
+    rnd = random.Random(seed)
+    directives = ['listen', 'server_name', 'root', 'index', 'proxy_pass',
+                  'proxy_set_header', 'add_header', 'return', 'rewrite', 'try_files']
+    orig = []
+    for n in range(lines):
+        if n % 20 == 0:
+            orig.append('server {')
+        elif n % 20 == 19:
+            orig.append('}')
+        else:
+            orig.append('    {} value_{};'.format(rnd.choice(directives), rnd.randint(0, lines // 4)))
+    fork = list(orig)
+    for _ in range(max(1, lines // 100)):
+        pos = rnd.randrange(len(fork))
+        action = rnd.random()
+        if action < 0.4:
+            fork[pos] = '    # edited ' + fork[pos].strip()
+        elif action < 0.7:
+            fork.insert(pos, '    add_header X-Inserted {};'.format(pos))
+        else:
+            del fork[pos]
+    return orig, fork
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    func(*args, **kwargs)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', default='1000,10000,100000')
+    parser.add_argument('--htmldiff-max', type=int, default=10000,
+                        help='skip HtmlDiff above this many lines')
+    args = parser.parse_args()
+
+    print('{:>8} {:>12} {:>12} {:>12}'.format('lines', 'HtmlDiff', 'table', 'render'))
+    for size in [int(s) for s in args.sizes.split(',')]:
+        (a, b) = make_pair(size)
+        if size <= args.htmldiff_max:
+            legacy = '{:.3f}s'.format(timed(difflib.HtmlDiff().make_table, a, b, 'a', 'b'))
+        else:
+            legacy = 'skipped'
+        table = timed(diff.make_table, a, b, 'a', 'b')
+        rendered = timed(diff.render, a, b, 'a', 'b', context=3)
+        print('{:>8} {:>12} {:>11.3f}s {:>11.3f}s'.format(size, legacy, table, rendered))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+'''
+Time modules.syntax.render with keyword links against the same formatter
+without links and against a stock HtmlFormatter, on generated pastes or a
+given file. The difference between the first two is what linking costs.
+
+    python benchmarks/bench_highlight.py [--syntaxes nginx,php,html]
+        [--sizes medium,huge] [--repeat 5] [--file nginx.conf --syntax nginx]
+'''
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pygments import highlight  # noqa: E402
+from pygments.formatters import HtmlFormatter  # noqa: E402
+
+from modules import syntax  # noqa: E402
+
+import corpus  # noqa: E402
+
+
+def best(repeat, funcs, *args):
+    '''
+    Returns the fastest of repeat calls of each function, after one untimed
+    call. Calls are interleaved so a busy machine skews them all alike.
+    '''
+    times = [[] for _ in funcs]
+    for n in range(repeat + 1):
+        for (func, timed) in zip(funcs, times):
+            start = time.perf_counter()
+            func(*args)
+            if n:
+                timed.append(time.perf_counter() - start)
+    return [min(timed) for timed in times]
+
+
+def stock(code, name):
+    return highlight(code, syntax.get_lexer(name), HtmlFormatter(linenos=True, cssclass='paste'))
+
+
+def unlinked(code, name):
+    return highlight(code, syntax.get_lexer(name), syntax.get_formatter())
+
+
+def run(label, code, name, repeat):
+    lines = code.count('\n')
+    times = best(repeat, (stock, unlinked, syntax.render), code, name)
+    print('{:>8} {:>8} {:>8} {:>9.3f}s {:>9.3f}s {:>9.3f}s {:>7.1f}%'.format(
+        name, label, lines, times[0], times[1], times[2], (times[2] / times[1] - 1) * 100))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--syntaxes', default='nginx,php,html')
+    parser.add_argument('--sizes', default='medium,huge')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--file', help='time this file instead of generated pastes')
+    parser.add_argument('--syntax', default='nginx', help='syntax of --file')
+    args = parser.parse_args()
+
+    syntax.warm()
+    print('{:>8} {:>8} {:>8} {:>10} {:>10} {:>10} {:>8}'.format(
+        'syntax', 'size', 'lines', 'pygments', 'unlinked', 'linked', 'links'))
+    if args.file:
+        with open(args.file) as f:
+            run('file', f.read(), args.syntax, args.repeat)
+        return
+    for name in args.syntaxes.split(','):
+        for size in args.sizes.split(','):
+            run(size, corpus.make_code(name, size), name, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+'''
+Generated pastes for the benchmarks, in the main syntaxes offered by the site.
+'''
+
+import random
+
+# Approximate line counts per size class
+SIZES = {'small': 20, 'medium': 400, 'huge': 5000}
+
+# Syntaxes exercised by default; nginx and php also go through kwlinker
+SYNTAXES = ('nginx', 'text', 'bash', 'python', 'php', 'html')
+
+_SNIPPETS = {
+    'nginx': [
+        'server {{',
+        '    listen 80;',
+        '    server_name example{n}.org www.example{n}.org;',
+        '    root /srv/www/site{n};',
+        '    index index.html index.php;',
+        '    location /app{n}/ {{',
+        '        proxy_pass http://127.0.0.1:{port};',
+        '        proxy_set_header Host $host;',
+        '        proxy_set_header X-Real-IP $remote_addr;',
+        '        add_header X-Served-By $hostname always;',
+        '    }}',
+        '    location ~ \\.php$ {{',
+        '        fastcgi_pass unix:/run/php/php-fpm.sock;',
+        '        fastcgi_param SCRIPT_FILENAME $document_root$fastcgi_script_name;',
+        '        include fastcgi_params;',
+        '    }}',
+        '    try_files $uri $uri/ /index.php?$args;',
+        '}}',
+    ],
+    'text': [
+        'Line {n} of a plain text paste, nothing to highlight here.',
+        '2017/01/01 00:00:{n:02d} [error] 1234#0: *{port} connect() failed (111: Connection refused)',
+        '',
+    ],
+    'bash': [
+        '#!/bin/bash',
+        'set -euo pipefail',
+        'for f in /var/log/nginx/*.log; do',
+        '    echo "rotating $f ({n})"',
+        '    gzip -9 "$f" && mv "$f.gz" /srv/archive/{n}/',
+        'done',
+        'if [ -z "${{PORT:-}}" ]; then PORT={port}; fi',
+    ],
+    'python': [
+        'def handler_{n}(request, port={port}):',
+        '    """Answer a request."""',
+        '    values = [x * 2 for x in range({n}) if x % 3]',
+        '    return {{"status": 200, "values": values}}',
+        '',
+        'class Worker{n}(object):',
+        '    def run(self):',
+        '        print("running", self, {port})',
+        '',
+    ],
+    'php': [
+        '<?php',
+        '$items = array_map(function ($x) {{ return $x * {n}; }}, range(0, 10));',
+        'echo htmlspecialchars(implode(",", $items));',
+        'if (strlen($name) > {n}) {{ $name = substr($name, 0, {n}); }}',
+        '$fp = fopen("/tmp/out{n}.txt", "w"); fwrite($fp, json_encode($items)); fclose($fp);',
+        '?>',
+    ],
+    'html': [
+        '<div class="item-{n}">',
+        '  <a href="/page/{n}">Page {n}</a>',
+        '  <img src="/img/{n}.png" alt="image {n}" width="{port}">',
+        '  <p>Some <strong>text</strong> and <em>more</em> text.</p>',
+        '</div>',
+    ],
+}
+
+
+def make_code(syntax, size, seed=0):
+    '''
+    Returns a paste of about SIZES[size] lines in the given syntax.
+    '''
+    rnd = random.Random('{}:{}:{}'.format(syntax, size, seed))
+    snippet = _SNIPPETS.get(syntax, _SNIPPETS['text'])
+    lines = []
+    while len(lines) < SIZES[size]:
+        n = rnd.randint(0, 999)
+        port = rnd.randint(1024, 65535)
+        lines.extend(line.format(n=n, port=port) for line in snippet)
+    return '\n'.join(lines[:SIZES[size]])
+
+
+def make_fork(code, seed=0):
+    '''
+    Returns a copy of code with about 2% of its lines edited.
+    '''
+    rnd = random.Random(seed)
+    lines = code.split('\n')
+    for _ in range(max(1, len(lines) // 50)):
+        pos = rnd.randrange(len(lines))
+        if rnd.random() < 0.5:
+            lines[pos] = lines[pos] + '  # edited'
+        else:
+            lines.insert(pos, '# inserted line {}'.format(pos))
+    return '\n'.join(lines)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+'''
+Load test app.py over HTTP under different servers, e.g. bottle's threaded
+wsgiref against gevent, with recaptcha and whois answering slowly.
+
+Each server runs in a child process against a local redis-server (database
+15 by default) or fakeredis. The same number of clients then post pastes
+through the web form, which waits on the captcha stub, and view pastes,
+whose first view is highlighted. Throughput and latency are printed per
+server, and written as JSON with --output.
+
+    python benchmarks/load_test.py [--servers wsgiref,gevent] [--clients 50]
+        [--duration 20] [--stub-delay 0.2] [--fakeredis]
+'''
+
+import argparse
+import concurrent.futures
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.parse
+
+import corpus
+
+# Pastes posted before measuring, for the views to pick from
+SEED_PASTES = 200
+
+
+def serve(args):
+    '''
+    Child process: run the app under args.server until killed.
+    '''
+    if args.server == 'gevent':
+        # Before anything imports socket or threading, as app.py does
+        from gevent import monkey
+        monkey.patch_all()
+    import bottle
+    import bench_app
+
+    # load_app() turns rate limits off; every client posts from 127.0.0.1
+    (app, _) = bench_app.load_app(args, args.stub_delay, python_server=args.server)
+    bottle.run(app.app, server=args.server, host='127.0.0.1', port=args.port, quiet=True)
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _request(port, method, path, form=None):
+    '''
+    Returns (status, body) of one request on a fresh connection.
+    '''
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        headers = {'Accept-Encoding': 'gzip, br'}
+        body = None
+        if form is not None:
+            body = urllib.parse.urlencode(form)
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        conn.request(method, path, body, headers)
+        response = conn.getresponse()
+        return (response.status, response.read())
+    finally:
+        conn.close()
+
+
+def _wait_ready(port, proc, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise RuntimeError('server exited with {}'.format(proc.returncode))
+        try:
+            if _request(port, 'GET', '/about')[0] == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('server did not start')
+
+
+def _form(code, webform):
+    return {'code': code, 'name': 'load', 'private': '0', 'syntax': 'nginx',
+            'webform': '1' if webform else '', 'g-recaptcha-response': 'load' if webform else ''}
+
+
+def run(args, server):
+    '''
+    Start one server, seed it and keep the clients busy for args.duration.
+    Returns the result for that server.
+    '''
+    port = _free_port()
+    cmd = [sys.executable, os.path.abspath(__file__), 'serve', server, '--port', str(port),
+           '--stub-delay', str(args.stub_delay), '--redis-db', str(args.redis_db),
+           '--prerender-workers', str(args.prerender_workers)]
+    if args.fakeredis:
+        cmd.append('--fakeredis')
+    proc = subprocess.Popen(cmd)
+    try:
+        _wait_ready(port, proc)
+        codes = [corpus.make_code('nginx', 'medium') for _ in range(8)]
+        ids = []
+        for n in range(SEED_PASTES):
+            (status, body) = _request(port, 'POST', '/', _form(codes[n % len(codes)] + '# {}\n'.format(n), False))
+            if status == 200:
+                ids.append(body.decode('utf-8').strip().rsplit('/', 1)[-1])
+        if not ids:
+            raise RuntimeError('could not seed any pastes')
+
+        deadline = time.monotonic() + args.duration
+
+        def client(seed):
+            rand = random.Random(seed)
+            (latencies, errors) = ([], 0)
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                try:
+                    if rand.random() < args.post_ratio:
+                        code = codes[rand.randrange(len(codes))] + '# {}\n'.format(rand.random())
+                        status = _request(port, 'POST', '/', _form(code, True))[0]
+                    else:
+                        status = _request(port, 'GET', '/' + rand.choice(ids))[0]
+                    ok = status in (200, 302, 303)
+                except OSError:
+                    ok = False
+                latencies.append(time.perf_counter() - start)
+                errors += 0 if ok else 1
+            return (latencies, errors)
+
+        start = time.monotonic()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=args.clients) as pool:
+            results = list(pool.map(client, range(args.clients)))
+        wall = time.monotonic() - start
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    latencies = sorted(t for (times, _) in results for t in times)
+    result = {
+        'server': server,
+        'clients': args.clients,
+        'requests': len(latencies),
+        'errors': sum(e for (_, e) in results),
+        'rps': round(len(latencies) / wall, 1),
+        'p50_ms': round(_percentile(latencies, 50) * 1000, 1),
+        'p99_ms': round(_percentile(latencies, 99) * 1000, 1)}
+    print('{server:<10} {requests:>7} requests {rps:>8.1f}/s p50 {p50_ms:>8.1f}ms p99 {p99_ms:>8.1f}ms'
+          ' errors {errors}'.format(**result), file=sys.stderr)
+    return result
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def main():
+    if sys.argv[1:2] == ['serve']:
+        parser = argparse.ArgumentParser()
+        parser.add_argument('serve')
+        parser.add_argument('server')
+        parser.add_argument('--port', type=int, required=True)
+        parser.add_argument('--stub-delay', type=float, default=0)
+        parser.add_argument('--redis-host', default='localhost')
+        parser.add_argument('--redis-port', type=int, default=6379)
+        parser.add_argument('--redis-socket', default='')
+        parser.add_argument('--redis-db', type=int, default=15)
+        parser.add_argument('--fakeredis', action='store_true')
+        parser.add_argument('--prerender-workers', type=int, default=0)
+        serve(parser.parse_args())
+        return
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--servers', default='wsgiref,gevent', help='bottle server names to compare')
+    parser.add_argument('--clients', type=int, default=50, help='concurrent clients')
+    parser.add_argument('--duration', type=float, default=20, help='seconds of load per server')
+    parser.add_argument('--post-ratio', type=float, default=0.2, help='share of requests that post')
+    parser.add_argument('--stub-delay', type=float, default=0.2, help='seconds recaptcha and whois take')
+    parser.add_argument('--redis-db', type=int, default=15)
+    parser.add_argument('--fakeredis', action='store_true', help='use fakeredis instead of a redis-server')
+    parser.add_argument('--prerender-workers', type=int, default=0)
+    parser.add_argument('--output', help='write results here')
+    args = parser.parse_args()
+
+    results = [run(args, server) for server in args.servers.split(',')]
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(json.dumps({'stub_delay': args.stub_delay, 'results': results}, indent=2) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+#!/usr/bin/env python
+'''
+Local stand-ins for the external services pbin talks to, so benchmarks
+never leave the machine: Team Cymru whois, the recaptcha verifier and irccat.
+'''
+
+import http.server
+import json
+import socketserver
+import threading
+import time
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    # Load tests open many connections at once
+    request_queue_size = 128
+
+
+def _serve(handler, delay=0):
+    server = _Server(('127.0.0.1', 0), handler)
+    # Seconds to wait before answering, to stand in for a remote service
+    server.delay = delay
+    threading.Thread(target=server.serve_forever, name='bench-stub', daemon=True).start()
+    return server
+
+
+class _WhoisHandler(socketserver.StreamRequestHandler):
+    '''
+    Speaks enough of the cymru bulk protocol for cymruwhois.Client.
+    Every address is reported inside its /24 (or /48).
+    '''
+    def handle(self):
+        time.sleep(self.server.delay)
+        for line in self.rfile:
+            line = line.decode('utf-8').strip()
+            if line.upper() == 'BEGIN':
+                self.wfile.write(b'Bulk mode; whois.cymru.com [bench stub]\n')
+            elif line.upper() == 'END':
+                break
+            elif line and (line[0].isdigit() or ':' in line):
+                self.wfile.write('64496 | {} | {} | ZZ | BENCH-AS, ZZ\n'.format(
+                        line, _prefix(line)).encode('utf-8'))
+            self.wfile.flush()
+
+
+def _prefix(addr):
+    if ':' in addr:
+        return ':'.join(addr.split(':')[:3]) + '::/48'
+    return '.'.join(addr.split('.')[:3]) + '.0/24'
+
+
+class _CaptchaHandler(http.server.BaseHTTPRequestHandler):
+    '''
+    Accepts every captcha answer.
+    '''
+    def do_GET(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        time.sleep(self.server.delay)
+        body = json.dumps({'success': True}).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_POST = do_GET
+
+    def log_message(self, *args):
+        pass
+
+
+class _IrccatHandler(socketserver.StreamRequestHandler):
+    '''
+    Counts relayed lines and throws them away.
+    '''
+    def handle(self):
+        for _ in self.rfile:
+            self.server.lines += 1
+
+
+def whois(delay=0):
+    '''
+    Returns (host, port) of a stub whois server.
+    '''
+    return _serve(_WhoisHandler, delay).server_address
+
+
+def captcha(delay=0):
+    '''
+    Returns the url of a stub captcha verifier.
+    '''
+    return 'http://{}:{}/siteverify'.format(*_serve(_CaptchaHandler, delay).server_address)
+
+
+def irccat():
+    '''
+    Returns a stub irccat server; server.lines counts what it received.
+    '''
+    server = _serve(_IrccatHandler)
+    server.lines = 0
+    return server
@@ -1,9 +1,13 @@
 #!/usr/bin/env python
 
 # local imports
+from . import caching
 from . import sanity
+from . import store
 
 import bottle
+import hmac
+import ipaddress
 import json
 
 
@@ -18,8 +22,12 @@ def run_cmd(conf, cache):
     commands = {
             'blacklist_paste': _cmd_blacklist_paste,
             'bl': _cmd_blacklist_paste,
+            'blacklist_batch': _cmd_blacklist_batch,
+            'blb': _cmd_blacklist_batch,
             'delete_paste': _cmd_delete_paste,
             'del': _cmd_delete_paste,
+            'delete_batch': _cmd_delete_batch,
+            'delb': _cmd_delete_batch,
             'whitelist_address': _cmd_whitelist_address,
             'wl': _cmd_whitelist_address,
             'greylist_address': _cmd_greylist_address,
@@ -44,45 +52,147 @@ def run_cmd(conf, cache):
 
     # Flight
     bottle.response.headers['Content-Type'] = 'application/json'
-    resp = commands[data['command']](cache, data)
+    resp = commands[data['command']](conf, cache, data)
     return json.dumps(resp)
 
 
-def _cmd_blacklist_paste(cache, data):
-    # Delete paste
-    _ = _delete_paste(cache, data)
+def bearer_authorized(conf):
+    '''
+    Returns True if the request carries the admin key as a bearer token.
+    '''
+    admin_key = conf.get('bottle', 'admin_key')
+    auth = bottle.request.get_header('Authorization', '')
+    return bool(admin_key) and hmac.compare_digest(auth, 'Bearer ' + admin_key)
 
-    # Block address
-    addr = bottle.request.environ.get('REMOTE_ADDR', 'undef').strip()
-    if sanity.blacklist_address(cache, addr):
-        return {'message': 'Added to black list; paste removed.'.format(addr), 'status': 'success'}
-    return {'message': 'unexpected error; task already complete?', 'status': 'error'}
 
+def _cmd_blacklist_paste(conf, cache, data):
+    '''
+    Blacklist the subnet a paste came from and remove every paste from it.
+    '''
+    paste_id = data.get('target')
+    if not paste_id:
+        return {'message': 'No paste provided.', 'status': 'error'}
+
+    (subnets, removed, unresolved) = _blacklist(conf, cache, [], [paste_id])
+    if paste_id in unresolved:
+        return {'message': 'Paste not found.', 'status': 'error'}
+    if not subnets:
+        return {'message': 'Paste removed; its address could not be blacklisted.', 'status': 'error'}
+    return {'message': 'Added to black list; {} paste(s) removed.'.format(len(removed)), 'status': 'success'}
 
-def _cmd_delete_paste(cache, data):
-    ret = _delete_paste(cache, data)
+
+def _cmd_blacklist_batch(conf, cache, data):
+    '''
+    Blacklist the subnets of a list of pastes and addresses, and remove
+    every paste written from them.
+    '''
+    targets = data.get('targets')
+    if not targets or not isinstance(targets, list):
+        return {'message': 'No targets provided.', 'status': 'error'}
+
+    (addrs, paste_ids) = _split_targets(targets)
+    (subnets, removed, unresolved) = _blacklist(conf, cache, addrs, paste_ids)
+    return {'message': 'Blacklisted {} subnet(s); {} paste(s) removed.'.format(len(subnets), len(removed)),
+            'status': 'success', 'removed': removed, 'unresolved': unresolved}
+
+
+def _cmd_delete_batch(conf, cache, data):
+    '''
+    Remove a list of pastes, and every paste from the subnets of listed addresses.
+    '''
+    targets = data.get('targets')
+    if not targets or not isinstance(targets, list):
+        return {'message': 'No targets provided.', 'status': 'error'}
+
+    (addrs, paste_ids) = _split_targets(targets)
+    (subnets, unresolved) = _address_subnets(addrs)
+    removed = _delete_many(conf, cache, paste_ids, subnets)
+    unresolved.extend(p for p in paste_ids if p not in removed)
+    return {'message': '{} paste(s) removed.'.format(len(removed)),
+            'status': 'success', 'removed': removed, 'unresolved': unresolved}
+
+
+def _blacklist(conf, cache, addrs, paste_ids):
+    '''
+    Blacklist the subnets of addresses and pastes, then remove their pastes.
+    Returns (subnet digests, removed paste ids, unresolved targets).
+    '''
+    (subnets, unresolved) = _address_subnets(addrs)
+    for (paste_id, origin) in zip(paste_ids, store.get_subnets(cache, *paste_ids)):
+        if origin is store.MISSING:
+            unresolved.append(paste_id)
+            continue
+        # Pastes from before the subnet was recorded only have their address
+        subnet = origin[0] or sanity.address_digest(origin[1])
+        if subnet:
+            subnets.add(subnet)
+
+    for subnet in subnets:
+        sanity.blacklist_subnet(cache, subnet)
+    removed = _delete_many(conf, cache, [p for p in paste_ids if p not in unresolved], subnets)
+    return (subnets, removed, unresolved)
+
+
+def _delete_many(conf, cache, paste_ids, subnets):
+    '''
+    Remove pastes and the pastes of subnets in one go, then drop them from proxy caches.
+    Returns the removed paste ids.
+    '''
+    removed = store.delete_many(cache, paste_ids, subnets)
+    if removed:
+        caching.purge(conf, removed)
+    return sorted(removed)
+
+
+def _split_targets(targets):
+    '''
+    Returns (addresses, paste ids) from a list of either.
+    '''
+    (addrs, paste_ids) = ([], [])
+    for target in targets:
+        target = str(target).strip()
+        try:
+            ipaddress.ip_address(target)
+            addrs.append(target)
+        except ValueError:
+            paste_ids.append(target)
+    return (addrs, paste_ids)
+
+
+def _address_subnets(addrs):
+    '''
+    Returns (set of subnet digests, addresses whose subnet wasn't found).
+    '''
+    (subnets, unresolved) = (set(), [])
+    for addr in addrs:
+        subnet = sanity.address_digest(addr)
+        if subnet:
+            subnets.add(subnet)
+        else:
+            unresolved.append(addr)
+    return (subnets, unresolved)
+
+
+def _cmd_delete_paste(conf, cache, data):
+    ret = _delete_paste(conf, cache, data)
     if ret:
         return ret
     return {'message': 'Paste deleted.', 'status': 'success'}
 
 
-def _delete_paste(cache, data):
-    paste = data.get('target')
-    if not paste:
+def _delete_paste(conf, cache, data):
+    paste_id = data.get('target')
+    if not paste_id:
         return {'message': 'No paste provided.', 'status': 'error'}
-    paste_id = 'paste:{}'.format(data['target'])
 
-    # Find paste origin address
-    paste = cache.get(paste_id)
-    if not paste:
+    # Remove paste and everything derived from it, then drop it from proxy caches
+    derived = store.delete(cache, paste_id)
+    if derived is None:
         return {'message': 'Paste not found.', 'status': 'error'}
-    addr = json.loads(paste)['origin_addr']
+    caching.purge(conf, {paste_id: derived})
 
-    # Remove paste
-    cache.delete(paste_id)
 
-
-def _cmd_whitelist_address(cache, data):
+def _cmd_whitelist_address(conf, cache, data):
     addr = data.get('target')
     if not addr:
         return {'message': 'No address provided.', 'status': 'error'}
@@ -92,20 +202,18 @@ def _cmd_whitelist_address(cache, data):
     return {'message': 'unexpected error; task already complete?', 'status': 'error'}
 
 
-def _cmd_greylist_address(cache, data):
+def _cmd_greylist_address(conf, cache, data):
     '''
     Don't block an address from using the service, but disable IRC relay.
     '''
-    paste = data.get('target')
-    if not paste:
+    paste_id = data.get('target')
+    if not paste_id:
         return {'message': 'No paste provided.', 'status': 'error'}
-    paste_id = 'paste:{}'.format(paste)
 
     # Find paste origin address
-    cpaste = cache.get(paste_id)
-    if not cpaste:
+    addr = store.get_field(cache, paste_id, 'origin_addr')
+    if not addr:
         return {'message': 'Paste not found.', 'status': 'error'}
-    addr = json.loads(cpaste)['origin_addr']
 
     # Greylist address
     if sanity.greylist_address(cache, addr):
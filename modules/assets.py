@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# local imports
+from . import utils
+
+import bottle
+import gzip
+import hashlib
+import mimetypes
+import os
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Hashed urls never change; plain ones may after an upgrade
+IMMUTABLE = 'public, max-age=31536000, immutable'
+MUTABLE = 'public, max-age=3600'
+
+# Content codings we can produce, best first
+ENCODINGS = ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Content types worth compressing
+_COMPRESSIBLE = ('text/', 'application/javascript', 'application/json', 'image/svg+xml',
+                 'image/vnd.microsoft.icon', 'image/x-icon')
+
+
+class Asset(object):
+    '''
+    A static file held in memory with its precompressed variants.
+    '''
+    __slots__ = ('name', 'hashed_name', 'content_type', 'etag', 'bodies')
+
+    def __init__(self, name, body, content_type=None):
+        if content_type is None:
+            content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') and 'charset' not in content_type:
+            content_type += '; charset=utf-8'
+        digest = hashlib.sha1(body).hexdigest()[:12]
+        (base, ext) = os.path.splitext(name)
+
+        self.name = name
+        self.hashed_name = '{}.{}{}'.format(base, digest, ext)
+        self.content_type = content_type
+        self.etag = '"{}"'.format(digest)
+        self.bodies = {'identity': body}
+        if content_type.startswith(_COMPRESSIBLE):
+            self.bodies.update(compress(body))
+
+
+class Manifest(object):
+    '''
+    All static files, loaded once at startup and served from memory.
+    Each file is reachable under its plain name and a content hashed name.
+    '''
+    def __init__(self, root=None):
+        self._by_name = {}
+        self._by_hashed = {}
+        if root:
+            self.load(root)
+
+    def load(self, root):
+        for (dirpath, _, filenames) in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                with open(path, 'rb') as f:
+                    self.add(os.path.relpath(path, root).replace(os.sep, '/'), f.read())
+
+    def add(self, name, body, content_type=None):
+        '''
+        Add a file, e.g. one generated at startup.
+        '''
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        asset = Asset(name, body, content_type)
+        self._by_name[name] = asset
+        self._by_hashed[asset.hashed_name] = asset
+        return asset
+
+    def url(self, name):
+        '''
+        Returns the content hashed url of a static file.
+        '''
+        asset = self._by_name.get(name)
+        if asset is None:
+            return '/static/' + name
+        return '/static/' + asset.hashed_name
+
+    def version(self):
+        '''
+        Returns a tag that changes whenever any static file does.
+        '''
+        return utils.sha512(''.join(sorted(self._by_hashed)))[:8]
+
+    def serve(self, filename):
+        '''
+        Returns an HTTPResponse for a static file.
+        '''
+        asset = self._by_hashed.get(filename)
+        cache_control = IMMUTABLE
+        if asset is None:
+            asset = self._by_name.get(filename)
+            cache_control = MUTABLE
+        if asset is None:
+            return bottle.HTTPError(404, 'File does not exist.')
+
+        headers = {'ETag': asset.etag, 'Cache-Control': cache_control, 'Vary': 'Accept-Encoding'}
+        match = bottle.request.get_header('If-None-Match')
+        if match and asset.etag in [t.strip() for t in match.split(',')]:
+            return bottle.HTTPResponse(status=304, **headers)
+
+        encoding = negotiate(bottle.request.get_header('Accept-Encoding', ''), asset.bodies)
+        if encoding != 'identity':
+            headers['Content-Encoding'] = encoding
+        return bottle.HTTPResponse(asset.bodies[encoding], content_type=asset.content_type, **headers)
+
+
+def compress(body, level=9, quality=11, keep_all=False):
+    '''
+    Returns {encoding: body} for each of ENCODINGS that makes body smaller,
+    or for every one of them with keep_all.
+    '''
+    variants = {'gzip': gzip.compress(body, level, mtime=0)}
+    if brotli is not None:
+        variants['br'] = brotli.compress(body, quality=quality)
+    if keep_all:
+        return variants
+    return {k: v for (k, v) in variants.items() if len(v) < len(body)}
+
+
+def negotiate(accept, available):
+    '''
+    Returns the best content coding from an Accept-Encoding header
+    among the available ones, preferring br, then gzip, then deflate.
+    '''
+    accepted = set()
+    refused = set()
+    for item in accept.split(','):
+        (coding, _, params) = item.strip().partition(';')
+        (refused if _zero_quality(params) else accepted).add(coding.strip().lower())
+    for coding in ('br', 'gzip', 'deflate'):
+        if coding in refused or coding not in available:
+            continue
+        if coding in accepted or '*' in accepted:
+            return coding
+    return 'identity'
+
+
+def _zero_quality(params):
+    params = params.replace(' ', '')
+    if not params.startswith('q='):
+        return False
+    try:
+        return float(params[2:]) == 0
+    except ValueError:
+        return False
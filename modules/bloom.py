@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+import os
+import threading
+import time
+
+# Channel used to announce black/grey list changes
+CHANNEL = 'pbin:lists'
+
+
+class BloomFilter(object):
+    '''
+    Bloom filter over hex digests, such as the sha512 subnet hashes.
+    '''
+    def __init__(self, size=1 << 20, hashes=7):
+        self.size = size
+        self.hashes = hashes
+        self._bits = bytearray(size // 8)
+
+    def _positions(self, digest):
+        # The digest is already uniformly distributed; slice it instead of rehashing
+        for i in range(self.hashes):
+            yield int(digest[i * 8:i * 8 + 8], 16) % self.size
+
+    def add(self, digest):
+        for pos in self._positions(digest):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, digest):
+        for pos in self._positions(digest):
+            if not self._bits[pos >> 3] & (1 << (pos & 7)):
+                return False
+        return True
+
+
+class ListFilter(object):
+    '''
+    In-process copy of the black and grey lists as a bloom filter.
+
+    A miss means the subnet is on neither list and Redis does not need to be
+    asked. The filter is rebuilt from Redis on start, whenever an entry is
+    removed and every `interval` seconds so expired entries drop out and
+    missed announcements are recovered.
+
+    The updating thread is started by the first lookup in each process,
+    so workers forked after the app is loaded each keep their own copy
+    current instead of inheriting one that no thread updates.
+    '''
+    def __init__(self, cache, interval=300):
+        self.cache = cache
+        self.interval = interval
+        self._filter = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Whatever was inherited over a fork is no longer updated
+                self._filter = None
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='pbin-listfilter', daemon=True).start()
+        return self
+
+    def might_contain(self, digest):
+        '''
+        Returns False only if digest is certainly on neither list.
+        '''
+        if self._pid != os.getpid():
+            self.start()
+        current = self._filter
+        if current is None:
+            return True
+        return digest in current
+
+    def _rebuild(self):
+        fresh = BloomFilter()
+        for pattern in ('ipblock:*', 'ipgrey:*'):
+            for key in self.cache.scan_iter(match=pattern, count=1000):
+                fresh.add(key.split(b':', 1)[1].decode('utf-8'))
+        self._filter = fresh
+
+    def _run(self):
+        delay = 1
+        while True:
+            pubsub = None
+            try:
+                pubsub = self.cache.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(CHANNEL)
+                self._rebuild()
+                rebuilt = time.monotonic()
+                delay = 1
+                while True:
+                    message = pubsub.get_message(timeout=1.0)
+                    if message:
+                        action, digest = message['data'].decode('utf-8').split(' ', 1)
+                        if action == 'add':
+                            self._filter.add(digest)
+                        else:
+                            self._rebuild()
+                            rebuilt = time.monotonic()
+                    elif time.monotonic() - rebuilt > self.interval:
+                        self._rebuild()
+                        rebuilt = time.monotonic()
+            except Exception as e:
+                # Without updates the filter can't be trusted; ask Redis until rebuilt
+                self._filter = None
+                print('List filter stopped updating: {}'.format(e))
+                if pubsub is not None:
+                    try:
+                        pubsub.close()
+                    except Exception:
+                        pass
+                time.sleep(delay)
+                delay = min(delay * 2, 60)
+
+
+def announce(cache, action, digest):
+    '''
+    Tell every ListFilter about a list change; action is 'add' or 'del'.
+    '''
+    cache.publish(CHANNEL, '{} {}'.format(action, digest))
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+# local imports
+from . import store
+from . import utils
+
+import bottle
+import os
+import requests
+
+
+def check_pastes(conf, cache, paste_ids, variant='', encoding=None):
+    '''
+    Set caching headers for a response built from pastes and answer
+    If-None-Match / If-Modified-Since with 304 before anything is loaded.
+    Responses with a negotiated content coding pass it as encoding.
+    Does nothing if a paste is missing or has no stored digest.
+    '''
+    validators = store.get_validators(cache, *paste_ids)
+    if any(v is store.MISSING or not v[0] for v in validators):
+        return
+
+    if encoding is not None:
+        variant = '{}.{}'.format(variant, encoding)
+    tag = '"{}"'.format('-'.join([variant] + [v[0] for v in validators]))
+    modified = max(int(v[1] or 0) for v in validators)
+    private = any(utils.str2bool(v[2]) for v in validators)
+    cache_control = '{}, max-age={}'.format(
+            'private' if private else 'public', conf.getint('bottle', 'cache_max_age'))
+
+    headers = {'ETag': tag, 'Cache-Control': cache_control,
+               'Surrogate-Key': surrogate_keys(paste_ids)}
+    if encoding is not None:
+        headers['Vary'] = 'Accept-Encoding'
+    proxy_ttl = conf.getint('bottle', 'proxy_cache_ttl')
+    if proxy_ttl > 0:
+        headers['X-Accel-Expires'] = str(proxy_ttl)
+    if modified:
+        headers['Last-Modified'] = bottle.http_date(modified)
+
+    if not_modified(tag, modified):
+        raise bottle.HTTPResponse(status=304, **headers)
+    for (name, value) in headers.items():
+        bottle.response.set_header(name, value)
+
+
+def send_encoded(body, encoding, content_type='text/html; charset=UTF-8'):
+    '''
+    Returns body after setting the headers for its content coding.
+    '''
+    bottle.response.set_header('Content-Type', content_type)
+    bottle.response.set_header('Vary', 'Accept-Encoding')
+    if encoding != 'identity':
+        bottle.response.set_header('Content-Encoding', encoding)
+    return body
+
+
+def surrogate_keys(paste_ids):
+    '''
+    Returns the Surrogate-Key header value for a response showing pastes.
+    '''
+    return ' '.join('paste-' + p for p in paste_ids)
+
+
+def not_modified(tag, modified=None):
+    '''
+    Returns True if the request's validators match the current ones.
+    '''
+    match = bottle.request.get_header('If-None-Match')
+    if match is not None:
+        tags = [t.strip() for t in match.split(',')]
+        return '*' in tags or tag in tags or 'W/' + tag in tags
+
+    since = bottle.request.get_header('If-Modified-Since')
+    if since and modified:
+        since = bottle.parse_date(since.split(';')[0].strip())
+        return since is not None and since >= int(modified)
+    return False
+
+
+def page_version(root_path, *extra):
+    '''
+    Returns a short tag that changes whenever the page templates do,
+    so cached pages are revalidated after an upgrade.
+    '''
+    views = os.path.join(root_path, 'views')
+    parts = list(extra)
+    for name in sorted(os.listdir(views)):
+        with open(os.path.join(views, name), encoding='utf-8') as f:
+            parts.append(f.read())
+    return utils.sha512('\0'.join(parts))[:8]
+
+
+def paste_paths(paste_id, derived=()):
+    '''
+    Returns the urls a front proxy may have cached for a paste,
+    including diffs listed among its derived keys.
+    '''
+    paths = ['/' + paste_id, '/r/' + paste_id, '/f/' + paste_id]
+    for key in derived:
+        parts = key.split(':')
+        if parts[0] == 'diff' and len(parts) == 4:
+            path = '/d/{}/{}'.format(parts[1], parts[2])
+            paths.append(path if parts[3] == 'full' else '{}?context={}'.format(path, parts[3]))
+    return paths
+
+
+def purge(conf, removed):
+    '''
+    Remove pastes, given as {paste_id: derived keys}, from the front proxy cache.
+
+    With purge_url set, each url from paste_paths() is sent as an HTTP
+    request (purge_method, PURGE by default) to purge_url with {path}
+    replaced. With purge_by_key set, one request is sent per paste instead,
+    with {key} replaced by its surrogate key and the key also sent as a
+    Surrogate-Key header; this covers every url showing the paste, query
+    strings included. With purge_file set, the paths or keys are appended
+    to that file for an external purger.
+    '''
+    by_key = utils.str2bool(conf.get('bottle', 'purge_by_key'))
+    if by_key:
+        targets = [surrogate_keys([paste_id]) for paste_id in removed]
+    else:
+        targets = [path for (paste_id, derived) in removed.items()
+                   for path in paste_paths(paste_id, derived)]
+
+    url = conf.get('bottle', 'purge_url')
+    if url:
+        method = conf.get('bottle', 'purge_method')
+        for target in targets:
+            headers = {'Surrogate-Key': target} if by_key else None
+            try:
+                requests.request(method, url.format(path=target, key=target), headers=headers, timeout=2)
+            except requests.RequestException as e:
+                print('Unable to purge {}: {}'.format(target, e))
+
+    filename = conf.get('bottle', 'purge_file')
+    if filename:
+        with open(filename, 'a', encoding='utf-8') as f:
+            f.write(''.join(target + '\n' for target in targets))
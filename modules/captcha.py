@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+# local imports
+from . import metrics
+from . import utils
+
+import requests
+import threading
+import time
+
+DEFAULT_URL = 'https://www.google.com/recaptcha/api/siteverify'
+
+# Verifier set up by configure()
+_verifier = None
+
+
+class Verifier(object):
+    '''
+    Checks captcha answers with the provider over a pooled session.
+
+    Rejected answers are cached briefly so a resubmitted form is not
+    verified twice; accepted ones are single use and never cached.
+    After `failures` errors in a row the provider is left alone for
+    `reset` seconds and answers follow the fail_open policy, as they
+    do when a request fails.
+    '''
+    def __init__(self, url=DEFAULT_URL, connect_timeout=2, read_timeout=5, fail_open=False,
+                 pool_size=10, failures=5, reset=30, cache_size=1024, cache_ttl=120):
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.fail_open = fail_open
+        self.failures = failures
+        self.reset = reset
+        self._errors = 0
+        self._open_until = 0
+        self._lock = threading.Lock()
+        self._results = utils.LRUCache(maxsize=cache_size, ttl=cache_ttl)
+        self._session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def verify(self, secret, answer, addr=None):
+        '''
+        Returns True if the captcha answer is valid.
+        '''
+        if not answer:
+            return False
+        if self._results.get(answer) is not None:
+            metrics.inc('pbin_captcha_total', result='cached')
+            return False
+
+        with self._lock:
+            if time.monotonic() < self._open_until:
+                metrics.inc('pbin_captcha_total', result='open')
+                return self.fail_open
+            # Let one request through to see if the provider is back
+            if self._open_until:
+                self._open_until = time.monotonic() + self.reset
+
+        data = {'secret': secret, 'response': answer}
+        if addr:
+            data['remoteip'] = addr
+        try:
+            with metrics.stage('captcha'):
+                response = self._session.post(self.url, data=data, timeout=self.timeout)
+                response.raise_for_status()
+                result = bool(response.json()['success'])
+        except (requests.RequestException, ValueError, KeyError) as e:
+            print('Captcha verification failed: {}'.format(e))
+            self._failed()
+            metrics.inc('pbin_captcha_total', result='error')
+            return self.fail_open
+
+        with self._lock:
+            self._errors = 0
+            self._open_until = 0
+        if not result:
+            self._results.set(answer, result)
+        metrics.inc('pbin_captcha_total', result='success' if result else 'rejected')
+        return result
+
+    def _failed(self):
+        with self._lock:
+            self._errors += 1
+            if self._errors >= self.failures:
+                self._open_until = time.monotonic() + self.reset
+
+
+def configure(conf):
+    '''
+    Set up the verifier from settings.
+    '''
+    global _verifier
+    _verifier = Verifier(
+            url=conf.get('bottle', 'recaptcha_url'),
+            connect_timeout=conf.getfloat('bottle', 'recaptcha_connect_timeout'),
+            read_timeout=conf.getfloat('bottle', 'recaptcha_timeout'),
+            fail_open=utils.str2bool(conf.get('bottle', 'recaptcha_fail_open')),
+            pool_size=conf.getint('bottle', 'recaptcha_pool_size'))
+
+
+def verify(secret, answer, addr=None):
+    '''
+    Returns True if the captcha answer is valid.
+    '''
+    global _verifier
+    if _verifier is None:
+        _verifier = Verifier()
+    return _verifier.verify(secret, answer, addr)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+import bisect
+import difflib
+import html
+
+# Regions without unique common lines are handed to difflib when small enough
+_SEQUENCEMATCHER_LIMIT = 250000
+
+# Above this many lines on either side a unified diff is rendered instead of a table
+TABLE_MAX_LINES = 20000
+
+# Unified diffs are cut off after this many lines of output
+UNIFIED_MAX_LINES = 5000
+
+# Unchanged lines shown around each change: unified default and upper bound
+UNIFIED_CONTEXT = 3
+MAX_CONTEXT = 100
+
+
+def opcodes(a, b):
+    '''
+    Compare two lists of lines using patience diff.
+    Returns difflib style opcodes: (tag, i1, i2, j1, j2).
+    '''
+    # Compare small integers instead of whole lines
+    ids = {}
+    a = [ids.setdefault(line, len(ids)) for line in a]
+    b = [ids.setdefault(line, len(ids)) for line in b]
+
+    matches = []
+    regions = [(0, len(a), 0, len(b))]
+    while regions:
+        (alo, ahi, blo, bhi) = regions.pop()
+
+        # Common prefix and suffix
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi - 1] == b[bhi - 1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+
+        anchors = _unique_lcs(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            (i0, j0) = (alo, blo)
+            for (i, j) in anchors:
+                matches.append((i, j))
+                regions.append((i0, i, j0, j))
+                (i0, j0) = (i + 1, j + 1)
+            regions.append((i0, ahi, j0, bhi))
+        elif (ahi - alo) * (bhi - blo) <= _SEQUENCEMATCHER_LIMIT:
+            sm = difflib.SequenceMatcher(None, a[alo:ahi], b[blo:bhi], autojunk=False)
+            for (i, j, n) in sm.get_matching_blocks():
+                matches.extend((alo + i + k, blo + j + k) for k in range(n))
+        # Otherwise the region is left as a plain replacement
+
+    matches.sort()
+    matches.append((len(a), len(b)))
+
+    codes = []
+    (i, j) = (0, 0)
+    for (mi, mj) in matches:
+        if i < mi and j < mj:
+            codes.append(('replace', i, mi, j, mj))
+        elif i < mi:
+            codes.append(('delete', i, mi, j, j))
+        elif j < mj:
+            codes.append(('insert', i, i, j, mj))
+        if mi == len(a) and mj == len(b):
+            break
+        if codes and codes[-1][0] == 'equal' and codes[-1][2] == mi:
+            (_, i1, _, j1, _) = codes[-1]
+            codes[-1] = ('equal', i1, mi + 1, j1, mj + 1)
+        else:
+            codes.append(('equal', mi, mi + 1, mj, mj + 1))
+        (i, j) = (mi + 1, mj + 1)
+    return codes
+
+
+def _unique_lcs(a, alo, ahi, b, blo, bhi):
+    '''
+    Returns the longest increasing run of line pairs that occur exactly
+    once on each side of the region.
+    '''
+    counts = {}
+    for i in range(alo, ahi):
+        (n, _) = counts.get(a[i], (0, 0))
+        counts[a[i]] = (n + 1, i)
+    pairs = {}
+    for j in range(blo, bhi):
+        (n, i) = counts.get(b[j], (0, 0))
+        if n == 1:
+            pairs[b[j]] = (i, j) if b[j] not in pairs else None
+    pairs = sorted(p for p in pairs.values() if p is not None)
+    if not pairs:
+        return []
+
+    # Patience sorting over b indexes finds the longest increasing subsequence
+    tails = []
+    tail_idx = []
+    back = [None] * len(pairs)
+    for (k, (_, j)) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(k)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = k
+        back[k] = tail_idx[pos - 1] if pos else None
+
+    lcs = []
+    k = tail_idx[-1]
+    while k is not None:
+        lcs.append(pairs[k])
+        k = back[k]
+    lcs.reverse()
+    return lcs
+
+
+def make_table(a, b, from_desc, to_desc, context=None):
+    '''
+    Returns an html side by side table of the differences.
+    With context set only that many unchanged lines are kept around each change.
+    '''
+    rows = ['<table class="diff">',
+            '<thead><tr><th class="diff_header" colspan="2">{}</th>'
+            '<th class="diff_header" colspan="2">{}</th></tr></thead><tbody>'.format(from_desc, to_desc)]
+    codes = opcodes(a, b)
+    last = len(codes) - 1
+
+    for (n, (tag, i1, i2, j1, j2)) in enumerate(codes):
+        if tag == 'equal':
+            if context is not None and i2 - i1 > 2 * context:
+                head = 0 if n == 0 else context
+                tail = 0 if n == last else context
+                _equal_rows(rows, a, i1, i1 + head, j1)
+                rows.append('<tr><td class="diff_next" colspan="4">&hellip;</td></tr>')
+                _equal_rows(rows, a, i2 - tail, i2, j2 - tail)
+            else:
+                _equal_rows(rows, a, i1, i2, j1)
+            continue
+
+        for k in range(max(i2 - i1, j2 - j1)):
+            (i, j) = (i1 + k, j1 + k)
+            if i < i2 and j < j2:
+                rows.append(_row(i, a[i], j, b[j], 'diff_chg', 'diff_chg'))
+            elif i < i2:
+                rows.append(_row(i, a[i], None, '', 'diff_sub', ''))
+            else:
+                rows.append(_row(None, '', j, b[j], '', 'diff_add'))
+
+    rows.append('</tbody></table>')
+    return '\n'.join(rows)
+
+
+def _equal_rows(rows, a, i1, i2, j1):
+    for k in range(i2 - i1):
+        rows.append(_row(i1 + k, a[i1 + k], j1 + k, a[i1 + k], '', ''))
+
+
+def _row(i, left, j, right, lclass, rclass):
+    return ('<tr><td class="diff_header">{}</td><td class="{}">{}</td>'
+            '<td class="diff_header">{}</td><td class="{}">{}</td></tr>').format(
+                '' if i is None else i + 1, lclass, html.escape(left),
+                '' if j is None else j + 1, rclass, html.escape(right))
+
+
+def make_unified(a, b, from_desc, to_desc, context=UNIFIED_CONTEXT, max_lines=UNIFIED_MAX_LINES):
+    '''
+    Returns an html unified diff, truncated after max_lines lines of output.
+    '''
+    out = ['--- ' + from_desc, '+++ ' + to_desc]
+    codes = opcodes(a, b)
+    hunks = _group(codes, context)
+
+    for hunk in hunks:
+        (_, i1, _, j1, _) = hunk[0]
+        (_, _, i2, _, j2) = hunk[-1]
+        out.append('@@ -{},{} +{},{} @@'.format(i1 + 1, i2 - i1, j1 + 1, j2 - j1))
+        for (tag, i1, i2, j1, j2) in hunk:
+            if tag == 'equal':
+                out.extend(' ' + html.escape(line) for line in a[i1:i2])
+                continue
+            out.extend('-' + html.escape(line) for line in a[i1:i2])
+            out.extend('+' + html.escape(line) for line in b[j1:j2])
+        if len(out) > max_lines:
+            out = out[:max_lines]
+            out.append('... diff truncated ...')
+            break
+
+    return '<pre class="diff">' + '\n'.join(out) + '</pre>'
+
+
+def _group(codes, context):
+    '''
+    Split opcodes into hunks with context lines around each change.
+    '''
+    hunks = []
+    hunk = []
+    for (tag, i1, i2, j1, j2) in codes:
+        if tag == 'equal':
+            if hunk and i2 - i1 > 2 * context:
+                hunk.append(('equal', i1, i1 + context, j1, j1 + context))
+                hunks.append(hunk)
+                hunk = []
+            if not hunk:
+                (i1, j1) = (max(i1, i2 - context), max(j1, j2 - context))
+        hunk.append((tag, i1, i2, j1, j2))
+    if hunk and not (len(hunk) == 1 and hunk[0][0] == 'equal'):
+        if hunk[-1][0] == 'equal':
+            (tag, i1, i2, j1, j2) = hunk[-1]
+            hunk[-1] = (tag, i1, min(i2, i1 + context), j1, min(j2, j1 + context))
+        hunks.append(hunk)
+    return hunks
+
+
+def render(a, b, from_desc, to_desc, context=None):
+    '''
+    Returns an html diff suited to the size of the input.
+    Context is honoured by both forms, up to MAX_CONTEXT lines.
+    '''
+    if context is not None:
+        context = min(context, MAX_CONTEXT)
+    if max(len(a), len(b)) > TABLE_MAX_LINES:
+        return make_unified(a, b, from_desc, to_desc, UNIFIED_CONTEXT if context is None else context)
+    return make_table(a, b, from_desc, to_desc, context)
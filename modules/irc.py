@@ -1,24 +1,152 @@
 #!/usr/bin/env python
 
 # local imports
+from . import metrics
+from . import store
 from . import utils
 
-import json
+import os
+import queue
 import socket
+import threading
+import time
+
+# Background relay, set up by configure()
+_relay = None
+
+
+class Relay(object):
+    '''
+    Background sender for irccat lines.
+
+    Lines are queued by the request and written by a single worker thread
+    over one reused connection. Whatever is waiting in the queue is sent
+    in one write, and a failed write reconnects with exponential backoff.
+    When the queue is full new lines are dropped rather than blocking the
+    request.
+
+    The worker thread is started by the first line queued in each process,
+    so workers forked after the app is loaded don't inherit a dead thread.
+    '''
+    def __init__(self, host, port, maxsize=1000, batch=50, idle=60, retries=5):
+        self.host = host
+        self.port = port
+        self.batch = batch
+        self.idle = idle
+        self.retries = retries
+        self.sent = 0
+        self.dropped = 0
+        self.failed = 0
+        self.maxsize = maxsize
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._sock = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # Lines and the connection inherited over a fork belong to the parent
+                self._queue = queue.Queue(maxsize=self.maxsize)
+                self._sock = None
+                self._pid = os.getpid()
+                threading.Thread(target=self._run, name='pbin-relay', daemon=True).start()
+        return self
+
+    @property
+    def depth(self):
+        return self._queue.qsize()
+
+    def enqueue(self, line):
+        '''
+        Queue a line for sending; returns False if it had to be dropped.
+        '''
+        if self._pid != os.getpid():
+            self.start()
+        try:
+            self._queue.put_nowait(line)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def _run(self):
+        while True:
+            try:
+                lines = [self._queue.get(timeout=self.idle)]
+            except queue.Empty:
+                # irccat may drop idle clients; don't hold a stale socket
+                self._close()
+                continue
+            while len(lines) < self.batch:
+                try:
+                    lines.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            self._send(''.join(lines).encode(), len(lines))
+
+    def _send(self, payload, count):
+        with metrics.stage('relay'):
+            self._send_retry(payload, count)
+
+    def _send_retry(self, payload, count):
+        view = memoryview(payload)
+        # Start of the first line not yet written in full
+        done = 0
+        delay = 0.5
+        for attempt in range(self.retries):
+            written = done
+            try:
+                if self._sock is None:
+                    self._sock = socket.create_connection((self.host, self.port), timeout=5)
+                while written < len(payload):
+                    written += self._sock.send(view[written:])
+                self.sent += count
+                return
+            except OSError:
+                # Complete lines went out; a line cut short is sent again whole
+                done = payload.rfind(b'\n', 0, written) + 1
+                self._close()
+                time.sleep(delay)
+                delay = min(delay * 2, 30)
+        remaining = payload.count(b'\n', done)
+        self.sent += count - remaining
+        self.failed += remaining
+        print('Unable to relay {} message(s) to {}:{}'.format(remaining, self.host, self.port))
+
+    def _close(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+
+def configure(conf):
+    '''
+    Set up the background relay if relaying is enabled.
+    '''
+    global _relay
+    if utils.str2bool(conf.get('bottle', 'relay_enabled')) and conf.get('bottle', 'relay_host'):
+        _relay = Relay(
+                conf.get('bottle', 'relay_host'),
+                int(conf.get('bottle', 'relay_port')),
+                maxsize=conf.getint('bottle', 'relay_queue_size'))
 
 
 def send_message(conf, cache, paste, paste_id):
     '''
-    Send notification to channels
+    Queue notification to channels
     '''
-    host = conf.get('bottle', 'relay_host')
-    port = int(conf.get('bottle', 'relay_port'))
+    if _relay is None:
+        return
     pw = conf.get('bottle', 'relay_pass')
 
     # Build the message to send to the channel
     if paste['forked_from']:
-        orig = json.loads(cache.get('paste:' + paste['forked_from']))
-        message = ''.join(['Paste from ', orig['name'],
+        orig_name = store.get_field(cache, paste['forked_from'], 'name') or 'unknown'
+        message = ''.join(['Paste from ', orig_name,
                            ' forked by ', paste['name'], ': [ ',
                            conf.get('bottle', 'url'), paste_id, ' ]'])
     else:
@@ -27,12 +155,18 @@ def send_message(conf, cache, paste, paste_id):
 
     # Only relay if paste is not private
     if conf.get('bottle', 'relay_chan') is not None and not utils.str2bool(paste['private']):
-        # For each channel, send the relay server a message
+        # For each channel, queue a line for the relay server
         # Note: Irccat uses section names, not channels
         for section in conf.get('bottle', 'relay_chan').split(','):
-            try:
-                s = socket.create_connection((host, port))
-                s.send('{};{};{}\n'.format(section, pw, message).encode())
-                s.close()
-            except:
-                print('Unable to send message to {}'.format(section))
+            if not _relay.enqueue('{};{};{}\n'.format(section, pw, message)):
+                print('Relay queue full; dropped message to {}'.format(section))
+
+
+def stats():
+    '''
+    Returns counters for the relay queue.
+    '''
+    if _relay is None:
+        return {'depth': 0, 'sent': 0, 'dropped': 0, 'failed': 0}
+    return {'depth': _relay.depth, 'sent': _relay.sent,
+            'dropped': _relay.dropped, 'failed': _relay.failed}
@@ -1,43 +1,75 @@
 import re
 
+from html import escape
+
+from .table import LinkTable, anchor
+
+from . import css
 from . import html
 from . import nginx
 from . import php
-from . import css
 
-from pygments.filter import simplefilter
-from pygments.token import Token
-
-@simplefilter
-def logging_linker(self, lexer, stream, options):
-    for ttype, value in stream:
-        print("value: '{}'  ttype: '{}'".format(value, ttype))
-        yield ttype, value
-
-def get_linker_by_name(name):
-    if 'nginx' == name:
-        return nginx.linker()
-    elif 'html' == name:
-        return html.linker()
-    elif 'php' == name:
-        return php.linker()
-    elif 'css' == name:
-        return css.linker()
-    #else:
-    #    return logging_linker()
-    return None
-
-_lnk_replacements = {
-    '_LNK_B_': '<a href="https://',
-    '_LNK_M_': '" target="_blank">',
-    '_LNK_E_': '</a>',
-    '_LNK__': '_LNK_',
+# Link tables per syntax: {token type: url template or LinkTable}.
+# Templates may use {word}, the linked word, and {slug}, the word with
+# underscores turned into dashes. To support another syntax add a module
+# with a LINKS table and list it here.
+LANGUAGES = {
+    'nginx': nginx.LINKS,
+    'html': html.LINKS,
+    'php': php.LINKS,
+    'css': css.LINKS,
 }
 
-_lnk_regex = re.compile('|'.join(_lnk_replacements.keys()))
+# The part of a token that gets linked, e.g. 'div' in '<div'
+_word = re.compile(r'[A-Za-z_][\w-]*')
+
+# Rendered links per (table, token type, value); bounded to keep memory flat
+_memo = {}
+_MEMO_MAX = 20000
+
+
+def get_links(name):
+    '''
+    Returns the link table for a syntax name or None.
+    '''
+    return LANGUAGES.get(name)
+
+
+def warm():
+    '''
+    Load every link table now rather than on first use.
+    '''
+    for links in LANGUAGES.values():
+        for template in links.values():
+            if isinstance(template, LinkTable):
+                template.load()
+
+
+def link(links, ttype, value):
+    '''
+    Returns escaped html for a token with its keyword linked,
+    or None if the token is not linked.
+    '''
+    template = links.get(ttype)
+    if template is None:
+        return None
+    if isinstance(template, LinkTable):
+        return template.get(value)
+
+    key = (id(links), ttype, value)
+    markup = _memo.get(key)
+    if markup is not None:
+        return markup
 
-def _lnk_replace(match):
-    return _lnk_replacements[match.group()]
+    match = _word.search(value)
+    if match is None:
+        return None
+    word = match.group()
+    url = template.format(word=word, slug=word.replace('_', '-'))
+    markup = ''.join((escape(value[:match.start()]), anchor(url, word),
+                      escape(value[match.end():])))
 
-def replace_markup(markup):
-    return _lnk_regex.sub(_lnk_replace, markup)
+    if len(_memo) >= _MEMO_MAX:
+        _memo.clear()
+    _memo[key] = markup
+    return markup
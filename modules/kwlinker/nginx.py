@@ -1,10 +1,12 @@
-from pygments.filter import simplefilter
 from pygments.token import Token
 
-@simplefilter
-def linker(self, lexer, stream, options):
-    for ttype, value in stream:
-        value = value.replace('_LNK_', '_LNK__')
-        if ttype is Token.Keyword or ttype is Token.Keyword.Namespace:
-            value = '_LNK_B_nginx.org/r/%s_LNK_M_%s_LNK_E_' % (value, value)
-        yield ttype, value
+from .table import LinkTable
+
+# Kept by hand or rebuilt with tools/build_nginx_links.py; unknown words are left unlinked
+_table = LinkTable('nginx.links')
+
+LINKS = {
+    Token.Keyword: _table,
+    Token.Keyword.Namespace: _table,
+    Token.Name.Variable: _table,
+}
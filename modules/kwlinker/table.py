@@ -0,0 +1,63 @@
+import os
+import threading
+import types
+
+from html import escape
+
+
+class LinkTable(object):
+    '''
+    Fixed set of linkable words loaded lazily from a data file.
+
+    Each line of the file holds a word and its url separated by a tab. Words
+    ending in '_' are prefixes, e.g. '$arg_' links '$arg_page'. The anchor
+    markup for every word is built once at load time.
+    '''
+    def __init__(self, filename):
+        self.path = os.path.join(os.path.dirname(os.path.abspath(__file__)), filename)
+        self._links = None
+        self._prefixes = ()
+        self._lock = threading.Lock()
+
+    def _load(self):
+        links = {}
+        prefixes = []
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                if line.startswith('#') or '\t' not in line:
+                    continue
+                (word, url) = line.rstrip('\n').split('\t', 1)
+                if word.endswith('_'):
+                    prefixes.append((word, url))
+                else:
+                    links[word] = anchor(url, word)
+        self._prefixes = tuple(prefixes)
+        self._links = types.MappingProxyType(links)
+
+    def load(self):
+        '''
+        Read the data file unless it has been read already.
+        '''
+        if self._links is None:
+            with self._lock:
+                if self._links is None:
+                    self._load()
+
+    def get(self, word):
+        '''
+        Returns anchor markup for word or None if it is not a known word.
+        '''
+        self.load()
+        markup = self._links.get(word)
+        if markup is None:
+            for (prefix, url) in self._prefixes:
+                if word.startswith(prefix) and word[len(prefix):].replace('_', '').isalnum():
+                    return anchor(url, word)
+        return markup
+
+
+def anchor(url, word):
+    '''
+    Returns link markup for word.
+    '''
+    return '<a href="{}" target="_blank">{}</a>'.format(escape(url), escape(word))
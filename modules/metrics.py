@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+# local imports
+from . import utils
+
+import bisect
+import threading
+import time
+
+# Exported metrics: name -> (type, help, histogram buckets)
+_SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+_BYTES = (256, 1024, 4096, 16384, 65536, 262144, 1048576)
+METRICS = {
+    'pbin_request_seconds': ('histogram', 'Time spent answering requests, by route.', _SECONDS),
+    'pbin_stage_seconds': ('histogram', 'Time spent in each stage of handling a request.', _SECONDS),
+    'pbin_paste_bytes': ('histogram', 'Size of submitted pastes.', _BYTES),
+    'pbin_cache_total': ('counter', 'Lookups in the render, page, diff and subnet caches.', None),
+    'pbin_captcha_total': ('counter', 'Captcha verifications, by outcome.', None),
+    'pbin_fail_open_total': ('counter', 'Addresses let through because no subnet was found.', None),
+}
+
+# Escapes for label values in the text format
+_LABEL_ESCAPE = {ord('\\'): '\\\\', ord('"'): '\\"', ord('\n'): '\\n'}
+
+_enabled = False
+_lock = threading.Lock()
+
+# (name, labels) -> value, or bucket counts followed by sum and count for histograms
+_values = {}
+
+# Values read when scraped: name -> (type, help, func returning [(labels, value)])
+_collectors = {}
+
+
+class _NoTimer(object):
+    '''
+    Stands in for a timer while metrics are disabled.
+    '''
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_TIMER = _NoTimer()
+
+
+class _Timer(object):
+    __slots__ = ('name', 'labels', 'start')
+
+    def __init__(self, name, labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.name, time.perf_counter() - self.start, **self.labels)
+        return False
+
+
+class Plugin(object):
+    '''
+    Bottle plugin timing every route.
+    '''
+    name = 'metrics'
+    api = 2
+
+    def apply(self, callback, route):
+        if not _enabled:
+            return callback
+
+        def wrapper(*args, **kwargs):
+            with _Timer('pbin_request_seconds', {'route': route.rule, 'method': route.method}):
+                return callback(*args, **kwargs)
+        return wrapper
+
+
+def configure(conf):
+    '''
+    Turn instrumentation on if enabled in settings.
+    '''
+    global _enabled
+    _enabled = utils.str2bool(conf.get('bottle', 'metrics_enabled'))
+
+
+def enabled():
+    return _enabled
+
+
+def stage(name):
+    '''
+    Returns a context manager timing one stage of a request.
+    '''
+    if not _enabled:
+        return _NO_TIMER
+    return _Timer('pbin_stage_seconds', {'stage': name})
+
+
+def inc(name, value=1, **labels):
+    '''
+    Add to a counter.
+    '''
+    if not _enabled:
+        return
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _values[key] = _values.get(key, 0) + value
+
+
+def observe(name, value, **labels):
+    '''
+    Record a value in a histogram.
+    '''
+    if not _enabled:
+        return
+    buckets = METRICS[name][2]
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        counts = _values.get(key)
+        if counts is None:
+            counts = _values[key] = [0] * (len(buckets) + 3)
+        counts[bisect.bisect_left(buckets, value)] += 1
+        counts[-2] += value
+        counts[-1] += 1
+
+
+def hit(cache_name, found):
+    '''
+    Count a cache lookup.
+    '''
+    inc('pbin_cache_total', cache=cache_name, result='hit' if found else 'miss')
+
+
+def register(name, kind, help_text, func):
+    '''
+    Export values computed when scraped; func returns [(labels, value)].
+    '''
+    _collectors[name] = (kind, help_text, func)
+
+
+def exposition():
+    '''
+    Returns all metrics in the Prometheus text format.
+    '''
+    with _lock:
+        values = sorted((k, list(v) if isinstance(v, list) else v) for (k, v) in _values.items())
+
+    out = []
+    for (name, (kind, help_text, buckets)) in sorted(METRICS.items()):
+        out.append('# HELP {} {}'.format(name, help_text))
+        out.append('# TYPE {} {}'.format(name, kind))
+        for ((key, labels), value) in values:
+            if key != name:
+                continue
+            if kind != 'histogram':
+                out.append('{}{} {}'.format(name, _labels(labels), value))
+                continue
+            cumulative = 0
+            for (bound, count) in zip(buckets + ('+Inf',), value):
+                cumulative += count
+                out.append('{}_bucket{} {}'.format(name, _labels(labels + (('le', bound),)), cumulative))
+            out.append('{}_sum{} {}'.format(name, _labels(labels), value[-2]))
+            out.append('{}_count{} {}'.format(name, _labels(labels), value[-1]))
+
+    for (name, (kind, help_text, func)) in sorted(_collectors.items()):
+        out.append('# HELP {} {}'.format(name, help_text))
+        out.append('# TYPE {} {}'.format(name, kind))
+        for (labels, value) in func():
+            out.append('{}{} {}'.format(name, _labels(tuple(sorted(labels.items()))), value))
+    return '\n'.join(out) + '\n'
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(k, str(v).translate(_LABEL_ESCAPE)) for (k, v) in labels) + '}'
@@ -1,39 +1,26 @@
 #!/usr/bin/env python
 
 # local imports
+from . import diff
 from . import irc
-from . import kwlinker
+from . import metrics
+from . import render
 from . import sanity
+from . import store
+from . import syntax
 from . import utils
 
-from pygments import highlight
-from pygments.lexers import *
-from pygments.formatters import HtmlFormatter
-
-import binascii
 import bottle
-import difflib
+import functools
 import json
-import os
+import zlib
 
 
-class HtmlLineFormatter(HtmlFormatter):
+def get_style():
     '''
-    Output as html and wrap each line in a span
+    Returns the stylesheet for highlighted pastes.
     '''
-    name = 'Html with line wrap'
-    aliases = ['htmlline']
-
-    def wrap(self, source, outfile):
-        return self._wrap_div(self._wrap_pre(self._wrap_lines(source)))
-
-    def _wrap_lines(self, source):
-        i = self.linenostart
-        for t, line in source:
-            if t == 1:
-                line = '<span class="linecount" id="LC%d">%s</span>' % (i, line)
-                i += 1
-            yield t, line
+    return syntax.HtmlLineFormatter().get_style_defs('.code')
 
 
 def new_paste(conf, cache=None, paste_id=None):
@@ -52,12 +39,12 @@ def new_paste(conf, cache=None, paste_id=None):
         'private': '0'}
 
     if paste_id and cache:
-        paste = json.loads(cache.get('paste:' + paste_id))
+        paste = store.get(cache, paste_id)
         if paste:
-            data.update(paste)
+            data['code'] = paste.code
+            data['syntax'] = paste.syntax
             data['paste_id'] = paste_id
-            data['private'] = str(utils.str2int(paste['private']))
-            data['name'] = ''
+            data['private'] = str(utils.str2int(paste.private))
 
     cookie = bottle.request.cookies.get('dat', None)
     if cookie:
@@ -67,53 +54,82 @@ def new_paste(conf, cache=None, paste_id=None):
     return (data, template)
 
 
-def get_paste(cache, paste_id, raw=False):
+def get_paste(cache, paste_id):
     '''
-    Return page with <paste_id>.
+    Return templating data for the page with <paste_id>.
     '''
-    paste_id = paste_id
-    if not cache.exists('paste:' + paste_id):
+    paste = store.get(cache, paste_id)
+    if not paste:
         bottle.redirect('/')
 
-    data = json.loads(cache.get('paste:' + paste_id))
+    return {
+        'paste': paste,
+        'code': render.get_rendered(cache, paste_id, paste.code, paste.syntax)}
 
-    if not raw:
-        # Syntax hilighting
-        try:
-            lexer = get_lexer_by_name(data['syntax'], stripall=False)
-        except:
-            lexer = get_lexer_by_name('text', stripall=False)
-        formatter = HtmlLineFormatter(linenos=True, cssclass="paste")
-        linker = kwlinker.get_linker_by_name(data['syntax'])
-        if linker is not None:
-            lexer.add_filter(linker)
-            data['code'] = highlight(data['code'], lexer, formatter)
-            data['code'] = kwlinker.replace_markup(data['code'])
-        else:
-            data['code'] = highlight(data['code'], lexer, formatter)
-        data['css'] = HtmlLineFormatter().get_style_defs('.code')
 
-    return data
+def get_page(cache, paste_id, version, encoding='identity'):
+    '''
+    Return the rendered page for <paste_id> as (body, encoding).
+    '''
+    def build():
+        return bottle.jinja2_template('view.html', pid=paste_id, **get_paste(cache, paste_id))
+    return render.get_page(cache, paste_id, version, encoding, build)
+
+
+def get_raw(cache, paste_id, deflate=False):
+    '''
+    Return only the code of <paste_id> as (body, encoding).
+    With deflate set, compressed code is sent as stored and plain code,
+    which is small or incompressible, is compressed on the way out so the
+    body always matches the deflate ETag it was checked against.
+    '''
+    stored = store.get_stored_code(cache, paste_id)
+    if stored is store.MISSING:
+        bottle.redirect('/')
+    (value, fmt) = stored
+    if deflate and fmt == store.FORMAT_ZLIB:
+        return (value, 'deflate')
+    code = store.decode_code(value, fmt).encode('utf-8')
+    if deflate:
+        return (zlib.compress(code, 1), 'deflate')
+    return (code, 'identity')
 
 
-def gen_diff(cache, orig, fork):
+def gen_diff(cache, orig, fork, context=None):
     '''
-    Returns a generated diff between two pastes.
+    Returns a generated diff between two pastes or None if either is missing.
+    The result is cached until either paste goes away.
     '''
-    po = json.loads(cache.get('paste:' + orig))
-    pf = json.loads(cache.get('paste:' + fork))
-    co = po['code'].split('\n')
-    cf = pf['code'].split('\n')
+    key = 'diff:{}:{}:{}'.format(orig, fork, 'full' if context is None else context)
+    cached = store.read(cache, 'get', key)
+    metrics.hit('diff', cached is not None)
+    if cached is not None:
+        return cached.decode('utf-8')
+
+    co = store.get_field(cache, orig, 'code')
+    cf = store.get_field(cache, fork, 'code')
+    if co is store.MISSING or cf is store.MISSING:
+        return None
+    co = co.split('\n')
+    cf = cf.split('\n')
     lo = '<a href="/' + orig + '">' + orig + '</a>'
     lf = '<a href="/' + fork + '">' + fork + '</a>'
 
-    return difflib.HtmlDiff().make_table(co, cf, lo, lf)
+    with metrics.stage('diff'):
+        table = render.offload(diff.render, co, cf, lo, lf, context)
+    store.put_derived(cache, key, table, orig, fork)
+    return table
 
 
 def submit_new(conf, cache):
     '''
     Handle processing for a new paste.
     '''
+    # Refuse oversized requests before reading the body
+    err = sanity.request_size_error()
+    if err:
+        return bottle.jinja2_template('error.html', code=200, message=err)
+
     paste_data = {
         'code': bottle.request.POST.get('code', ''),
         'name': bottle.request.POST.get('name', '').strip(),
@@ -128,29 +144,46 @@ def submit_new(conf, cache):
 
     # Handle file uploads
     if type(paste_data['code']) == bottle.FileUpload:
-        paste_data['code'] = '# FileUpload: {}\n{}'.format(
-                paste_data['code'].filename,
-                paste_data['code'].file.getvalue())
+        upload = paste_data['code']
+        (code, err) = sanity.read_upload(upload, conf.getint('bottle', 'max_upload'))
+        if err:
+            return bottle.jinja2_template('error.html', code=200, message=err)
+        paste_data['code'] = '# FileUpload: {}\n{}'.format(upload.filename, code)
 
     # Validate data
     (valid, err) = sanity.validate_data(conf, paste_data)
     if not valid:
         return bottle.jinja2_template('error.html', code=200, message=err)
 
+    metrics.observe('pbin_paste_bytes', len(paste_data['code'].encode('utf-8')))
+
+    # Unknown syntaxes are stored as plain text so views never need a fallback
+    paste_data['syntax'] = syntax.normalize(paste_data['syntax'])
+
     # Check recapcha answer if not cli post
     if utils.str2bool(conf.get('bottle', 'check_spam')) and not cli_post:
         if not sanity.check_captcha(
                 conf.get('bottle', 'recaptcha_secret'),
-                paste_data['recaptcha_answer']):
+                paste_data['recaptcha_answer'],
+                paste_data['origin_addr']):
             return bottle.jinja2_template('error.html', code=200, message='Invalid captcha verification. ERR:677')
 
-    # Check address against blacklist
-    if sanity.address_blacklisted(cache, paste_data['origin_addr']):
+    # Check address against black and grey lists
+    status = sanity.address_status(cache, paste_data['origin_addr'])
+    if status.blacklisted:
         return bottle.jinja2_template('error.html', code=200, message='Address blacklisted. ERR:840')
 
     # Stick paste into cache
+    paste_data['subnet'] = status.digest or ''
     paste_id = _write_paste(cache, paste_data)
 
+    # Render it in the background. The IRC relay waits for the render so
+    # the burst of viewers from the channel finds the page ready.
+    relay = None
+    if not cli_post and utils.str2bool(conf.get('bottle', 'relay_enabled')) and not status.greylisted and utils.str2bool(paste_data['private']):
+        relay = functools.partial(irc.send_message, conf, cache, paste_data, paste_id)
+    render.prerender(cache, paste_id, paste_data['code'], paste_data['syntax'], then=relay)
+
     # Set cookie for user
     bottle.response.set_cookie(
             'dat',
@@ -165,9 +198,6 @@ def submit_new(conf, cache):
         host = bottle.request.get_header('host')
         return '{}://{}/{}\n'.format(scheme, host, paste_id)
     else:
-        # Relay message to IRC
-        if utils.str2bool(conf.get('bottle', 'relay_enabled')) and not sanity.address_greylisted(cache, paste_data['origin_addr']) and utils.str2bool(paste_data['private']):
-            irc.send_message(conf, cache, paste_data, paste_id)
         bottle.redirect('/' + paste_id)
 
 
@@ -184,15 +214,5 @@ def _write_paste(cache, paste_data):
     elif utils.str2bool(paste_data['private']):
         id_length = 8
 
-    # Pick a unique ID
-    paste_id = binascii.b2a_hex(os.urandom(id_length)).decode('utf-8')
-
-    # Make sure it's actually unique or else create a new one and test again
-    while cache.exists('paste:' + paste_id):
-        id_length += 1
-        paste_id = binascii.b2a_hex(os.urandom(id_length)).decode('utf-8')
-
-    # Put the paste into cache
-    cache.setex('paste:' + paste_id, 345600, json.dumps(paste_data))
-
-    return paste_id
+    # Put the paste into cache under a unique ID
+    return store.create(cache, paste_data, id_length)
@@ -0,0 +1,93 @@
+#!/usr/bin/env python
+
+# local imports
+from . import sanity
+from . import utils
+
+import bottle
+import math
+import time
+
+# Take a token from a client's bucket unless it is exempt.
+# KEYS: bucket, then exemptions; ARGV: burst, tokens per second, now in ms
+# Returns {allowed, ms until a token is available}.
+_BUCKET_LUA = '''
+for i = 2, #KEYS do
+    if redis.call('EXISTS', KEYS[i]) == 1 then
+        return {1, 0}
+    end
+end
+local burst = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local ts = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate / 1000)
+local allowed, wait = 0, 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    wait = math.ceil((1 - tokens) * 1000 / rate)
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst * 1000 / rate))
+return {allowed, wait}
+'''
+_bucket_script = None
+
+# Routes that can be limited, each read from a ratelimit_<route> setting
+ROUTES = ('post', 'view', 'diff')
+
+# route -> (burst, tokens per second), set up by configure()
+_limits = {}
+
+
+def configure(conf):
+    '''
+    Read the per route limits, given as requests/seconds (e.g. 20/60).
+    An empty setting leaves the route unlimited.
+    '''
+    _limits.clear()
+    for route in ROUTES:
+        value = conf.get('bottle', 'ratelimit_' + route).strip()
+        if not value:
+            continue
+        (count, _, seconds) = value.partition('/')
+        (count, seconds) = (int(count), int(seconds or 1))
+        if count > 0 and seconds > 0:
+            _limits[route] = (count, count / seconds)
+
+
+def check(cache, route):
+    '''
+    Take a token for the requesting client; answers with 429 when it has none left.
+    '''
+    limit = _limits.get(route)
+    if limit is None:
+        return
+
+    global _bucket_script
+    if _bucket_script is None:
+        _bucket_script = cache.register_script(_BUCKET_LUA)
+
+    addr = bottle.request.environ.get('REMOTE_ADDR', 'undef').strip()
+    # Buckets are keyed the same in every process whatever it has cached.
+    # Exemptions are kept per address and per subnet; the subnet is only
+    # looked up locally, a flood would reach whois before being limited.
+    client = sanity.client_digest(addr)
+    keys = ['ratelimit:{}:{}'.format(route, client), 'ipexempt:{}'.format(client)]
+    subnet = sanity.address_digest(addr, whois=False)
+    if subnet:
+        keys.append('ipexempt:{}'.format(subnet))
+    (allowed, wait) = _bucket_script(
+            keys=keys,
+            args=[limit[0], limit[1], int(time.time() * 1000)],
+            client=cache)
+    if allowed:
+        return
+
+    body = bottle.jinja2_template('error.html', code=429,
+                                  message='Too many requests, please slow down. ERR:429')
+    raise bottle.HTTPResponse(body, status=429, headers={'Retry-After': str(max(1, math.ceil(wait / 1000)))})
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+
+# local imports
+from . import assets
+from . import metrics
+from . import store
+from . import syntax
+
+import concurrent.futures
+import threading
+import time
+
+# How long a render may hold the cross-process lock
+LOCK_TTL = 30
+
+# How long highlighted html is kept; it is only needed until the page
+# built from it is cached, which holds its own copy
+RENDER_TTL = 600
+
+# Cached pages are compressed once, so spend a little more time on them
+PAGE_GZIP_LEVEL = 9
+PAGE_BROTLI_QUALITY = 9
+
+# Background pool for rendering new pastes, set up by configure()
+_pool = None
+
+# Runs CPU bound work on a real thread under gevent, set up by configure()
+_offload = None
+
+# Renders in progress in this process: paste_id -> Future
+_inflight = {}
+_inflight_lock = threading.Lock()
+
+
+def configure(conf):
+    '''
+    Start the pre-render pool if enabled.
+    '''
+    global _pool, _offload
+    workers = conf.getint('bottle', 'prerender_workers')
+    if workers > 0:
+        _pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='pbin-render')
+    if conf.get('bottle', 'python_server') == 'gevent':
+        # Patched threads are greenlets, so highlighting in one would stall
+        # the loop; the hub's pool has real threads and leaves it serving
+        import gevent
+        syntax.warm()
+        _offload = gevent.get_hub().threadpool.apply
+
+
+def offload(func, *args, **kwargs):
+    '''
+    Returns func(*args, **kwargs). Under gevent it runs on a real thread
+    while other requests are served; func must not touch Redis or sockets.
+    '''
+    if _offload is None:
+        return func(*args, **kwargs)
+    return _offload(func, args, kwargs)
+
+
+def prerender(cache, paste_id, code, name, then=None):
+    '''
+    Render a new paste in the background, then call then().
+    Without a pool nothing is rendered ahead and then() is called right away.
+    '''
+    if _pool is None:
+        if then is not None:
+            then()
+        return
+
+    def job():
+        try:
+            get_rendered(cache, paste_id, code, name)
+        except Exception as e:
+            print('Unable to pre-render {}: {}'.format(paste_id, e))
+        if then is not None:
+            then()
+
+    _pool.submit(job)
+
+
+def get_rendered(cache, paste_id, code, name):
+    '''
+    Returns highlighted html for a paste, rendering it only once.
+    The rendered copy is kept for RENDER_TTL seconds, enough for a
+    pre-rendered paste to be viewed and its page cached.
+
+    Concurrent first views share one render: threads in this process wait
+    on the same future and other processes wait on a lock in Redis.
+    '''
+    rendered = store.read(cache, 'get', 'render:' + paste_id)
+    metrics.hit('render', rendered is not None)
+    if rendered is not None:
+        return rendered.decode('utf-8')
+
+    with _inflight_lock:
+        future = _inflight.get(paste_id)
+        owner = future is None
+        if owner:
+            future = _inflight[paste_id] = concurrent.futures.Future()
+    if not owner:
+        try:
+            return future.result(timeout=LOCK_TTL)
+        except concurrent.futures.TimeoutError:
+            # The first view is stuck; don't fail this one along with it
+            print('Render of {} timed out, rendering again'.format(paste_id))
+            with metrics.stage('highlight'):
+                return offload(syntax.render, code, name)
+
+    try:
+        rendered = _render_locked(cache, paste_id, code, name)
+        future.set_result(rendered)
+        return rendered
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[paste_id]
+
+
+def _render_locked(cache, paste_id, code, name):
+    lock = 'renderlock:' + paste_id
+    token = store.acquire_lock(cache, lock, LOCK_TTL)
+    if token is None:
+        # Another process is rendering; wait for its result
+        deadline = time.monotonic() + LOCK_TTL
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            rendered = cache.get('render:' + paste_id)
+            if rendered is not None:
+                return rendered.decode('utf-8')
+            if not cache.exists(lock):
+                break
+
+    try:
+        with metrics.stage('highlight'):
+            rendered = offload(syntax.render, code, name)
+        ttl = cache.ttl('paste:' + paste_id)
+        if ttl and ttl > 0:
+            cache.setex('render:' + paste_id, min(ttl, RENDER_TTL), rendered)
+    finally:
+        if token is not None:
+            store.release_lock(cache, lock, token)
+    return rendered
+
+
+def get_page(cache, paste_id, version, encoding, build):
+    '''
+    Returns (body, encoding) of the full page for a paste, calling build()
+    for its html only when the page is not cached yet. Pages are stored
+    together with every compressed variant under the page version, so
+    each variant is produced once rather than on every request and the
+    requested encoding, which the ETag was computed for, is always served.
+    '''
+    key = 'page:{}:{}'.format(paste_id, version)
+    (body, plain) = store.read(cache, 'hmget', key, encoding, 'identity')
+    metrics.hit('page', plain is not None)
+    if body is not None:
+        return (body, encoding)
+
+    # Not cached yet, or stored by a worker that lacks this encoding
+    if plain is None:
+        plain = build().encode('utf-8')
+    with metrics.stage('compress'):
+        bodies = offload(assets.compress, plain, PAGE_GZIP_LEVEL, PAGE_BROTLI_QUALITY, keep_all=True)
+    bodies['identity'] = plain
+    store.put_derived(cache, key, bodies, paste_id)
+    return (bodies[encoding], encoding)
@@ -1,13 +1,40 @@
 #!/usr/bin/env python
 
 # local imports
+from . import bloom
+from . import captcha
+from . import metrics
+from . import subnets
 from . import utils
 
+import codecs
+import collections
 import cymruwhois
 import bottle
-import requests
+import ipaddress
 import re
 
+# Subnet lookup state, set up by configure()
+_subnet_table = None
+_subnet_cache = utils.LRUCache(maxsize=4096, ttl=3600)
+_whois_fallback = True
+_list_filter = None
+
+
+def configure(conf, cache):
+    '''
+    Load the local subnet table and lookup settings.
+    '''
+    global _subnet_table, _subnet_cache, _whois_fallback, _list_filter
+    path = conf.get('bottle', 'subnet_file')
+    _subnet_table = subnets.load(path) if path else None
+    _subnet_cache = utils.LRUCache(
+            maxsize=conf.getint('bottle', 'subnet_cache_size'),
+            ttl=conf.getint('bottle', 'subnet_cache_ttl'))
+    _whois_fallback = utils.str2bool(conf.get('bottle', 'whois_fallback'))
+    if utils.str2bool(conf.get('bottle', 'list_filter')):
+        _list_filter = bloom.ListFilter(cache)
+
 
 def validate_data(conf, paste_data):
     '''
@@ -17,10 +44,7 @@ def validate_data(conf, paste_data):
     codetype = type(paste_data['code'])
     error = None
 
-    if max(0, bottle.request.content_length) > bottle.request.MEMFILE_MAX:
-        error = 'This request is too large to process. ERR:991'
-
-    elif codetype != str and codetype != bottle.FileUpload:
+    if codetype != str and codetype != bottle.FileUpload:
         error = 'Invalid code type submitted. ERR:280'
 
     elif not re.match(r'^[a-zA-Z\[\]\\{}|`\-_][a-zA-Z0-9\[\]\\{}|`\-_]*$', paste_data['name']):
@@ -38,34 +62,102 @@ def validate_data(conf, paste_data):
     return (True, None)
 
 
+def request_size_error():
+    '''
+    Returns an error message if the request body is over the limit or its
+    size is not declared up front, as with chunked uploads. Checked before
+    the body is parsed so large posts are never buffered.
+    '''
+    chunked = 'chunked' in bottle.request.get_header('Transfer-Encoding', '').lower()
+    if chunked or bottle.request.content_length < 0:
+        return 'Requests must declare their size with Content-Length. ERR:993'
+    if bottle.request.content_length > bottle.request.MEMFILE_MAX:
+        return 'This request is too large to process. ERR:991'
+    return None
+
+
+def read_upload(upload, limit, chunk_size=65536):
+    '''
+    Read an uploaded file as utf-8 text in chunks, stopping at limit bytes.
+    Returns (text, error_message).
+    '''
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    parts = []
+    size = 0
+    try:
+        while True:
+            chunk = upload.file.read(chunk_size)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > limit:
+                return (None, 'Uploaded file is too large. ERR:992')
+            parts.append(decoder.decode(chunk))
+        parts.append(decoder.decode(b'', final=True))
+    except UnicodeDecodeError:
+        return (None, 'Uploaded file is not valid UTF-8 text. ERR:281')
+    return (''.join(parts), None)
+
+
 def check_captcha(secret, answer, addr=None):
     '''
     Returns True if captcha response is valid.
     '''
-    provider = 'https://www.google.com/recaptcha/api/siteverify'
-    qs = {
-        'secret': secret,
-        'response': answer}
-    if addr:
-        qs['remoteip'] = addr
+    return captcha.verify(secret, answer, addr)
 
-    response = requests.get(provider, params=qs)
-    result = response.json()
 
-    return result['success']
+AddressStatus = collections.namedtuple('AddressStatus', ('digest', 'blacklisted', 'greylisted'))
 
 
-def address_blacklisted(cache, addr):
+def address_digest(addr, whois=True):
     '''
-    Returns True if address is currently blacklisted.
+    Returns the hash of the subnet of an address, as used for list keys,
+    or None if the subnet can't be found. Without whois only the subnet
+    cache and the local table are asked.
     '''
-    subnet = _addr_subnet(addr)
+    subnet = _addr_subnet(addr, whois)
     if not subnet:
-        # Fail open?
         return None
-    if cache.exists('ipblock:{}'.format(utils.sha512(subnet))):
-        return True
-    return False
+    return utils.sha512(subnet)
+
+
+def client_digest(addr):
+    '''
+    Returns the hash identifying a client for rate limits: its address,
+    or its /64 for IPv6 where one host usually holds the whole network.
+    Unlike address_digest it needs no lookup, so it is the same everywhere.
+    '''
+    try:
+        ip = ipaddress.ip_address(addr)
+    except ValueError:
+        return utils.sha512(addr)
+    if ip.version == 6:
+        if ip.ipv4_mapped is None:
+            return utils.sha512(str(ipaddress.ip_network((ip, 64), strict=False)))
+        ip = ip.ipv4_mapped
+    return utils.sha512(str(ip))
+
+
+def address_status(cache, addr):
+    '''
+    Check an address against both the black and grey lists at once.
+    Returns an AddressStatus; when the subnet can't be found the flags
+    are None and the address is let through.
+    '''
+    digest = address_digest(addr)
+    if not digest:
+        # Fail open?
+        metrics.inc('pbin_fail_open_total')
+        return AddressStatus(None, None, None)
+
+    if _list_filter is not None and not _list_filter.might_contain(digest):
+        return AddressStatus(digest, False, False)
+
+    pipe = cache.pipeline(transaction=False)
+    pipe.exists('ipblock:{}'.format(digest))
+    pipe.exists('ipgrey:{}'.format(digest))
+    (blocked, grey) = pipe.execute()
+    return AddressStatus(digest, bool(blocked), bool(grey))
 
 
 def blacklist_address(cache, addr):
@@ -73,37 +165,39 @@ def blacklist_address(cache, addr):
     Add address to blacklist.
     Returns True if successfully added or False if error encountered.
     '''
-    subnet = _addr_subnet(addr)
-    if not subnet:
+    digest = address_digest(addr)
+    if not digest:
         return False
-    cache.setex('ipblock:{}'.format(utils.sha512(subnet)), 345600, 'nil')
+    cache.delete('ipexempt:{}'.format(client_digest(addr)))
+    blacklist_subnet(cache, digest)
     return True
 
 
-def whitelist_address(cache, addr):
+def blacklist_subnet(cache, digest):
     '''
-    Remove address from blacklist.
-    Returns True if successfully removed or False if error encountered.
+    Add a subnet, given by its digest, to blacklist.
     '''
-    subnet = _addr_subnet(addr)
-    if not subnet:
-        return False
-    cache.delete('ipblock:{}'.format(utils.sha512(subnet)))
-    cache.delete('ipgrey:{}'.format(utils.sha512(subnet)))
-    return True
+    cache.setex('ipblock:{}'.format(digest), 345600, 'nil')
+    cache.delete('ipexempt:{}'.format(digest))
+    bloom.announce(cache, 'add', digest)
 
 
-def address_greylisted(cache, addr):
+def whitelist_address(cache, addr):
     '''
-    Returns True if address is currently greylisted.
+    Remove address from blacklist and exempt it from rate limits.
+    Returns True if successfully removed or False if error encountered.
     '''
-    subnet = _addr_subnet(addr)
-    if not subnet:
-        # Fail open?
-        return None
-    if cache.exists('ipgrey:{}'.format(utils.sha512(subnet))):
-        return True
-    return False
+    digest = address_digest(addr)
+    if not digest:
+        return False
+    pipe = cache.pipeline()
+    pipe.delete('ipblock:{}'.format(digest), 'ipgrey:{}'.format(digest))
+    # The rate limiter can't always tell the subnet, so exempt the address too
+    pipe.set('ipexempt:{}'.format(digest), 'nil')
+    pipe.set('ipexempt:{}'.format(client_digest(addr)), 'nil')
+    pipe.execute()
+    bloom.announce(cache, 'del', digest)
+    return True
 
 
 def greylist_address(cache, addr):
@@ -111,20 +205,43 @@ def greylist_address(cache, addr):
     Add an address to grey listing: don't block, don't relay.
     Returns True if successfully added or False if error encountered.
     '''
-    subnet = _addr_subnet(addr)
-    if not subnet:
+    digest = address_digest(addr)
+    if not digest:
         return False
-    cache.setex('ipgrey:{}'.format(utils.sha512(subnet)), 345600, 'nil')
+    cache.setex('ipgrey:{}'.format(digest), 345600, 'nil')
+    cache.delete('ipexempt:{}'.format(digest), 'ipexempt:{}'.format(client_digest(addr)))
+    bloom.announce(cache, 'add', digest)
     return True
 
 
-def _addr_subnet(addr):
+def _addr_subnet(addr, whois=True):
     '''
     Returns a subnet for an address.
+    The local subnet table is used first; whois is only asked on a miss.
+    '''
+    subnet = _subnet_cache.get(addr)
+    metrics.hit('subnet', subnet)
+    if subnet:
+        return subnet
+
+    if _subnet_table is not None:
+        subnet = _subnet_table.lookup(addr)
+    if not subnet and whois and _whois_fallback:
+        subnet = _whois_subnet(addr)
+
+    if subnet:
+        _subnet_cache.set(addr, subnet)
+    return subnet
+
+
+def _whois_subnet(addr):
+    '''
+    Returns a subnet for an address as reported by Team Cymru.
     '''
     client = cymruwhois.Client()
     try:
-        resp = client.lookup(addr)
+        with metrics.stage('whois'):
+            resp = client.lookup(addr)
         return resp.prefix
     except:
         return None
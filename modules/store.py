@@ -0,0 +1,506 @@
+#!/usr/bin/env python
+
+# local imports
+from . import metrics
+
+import binascii
+import hashlib
+import json
+import os
+import redis
+import time
+import zlib
+
+# Pastes live for four days
+PASTE_TTL = 345600
+
+# Fields kept for every paste
+FIELDS = ('code', 'name', 'private', 'syntax', 'forked_from', 'origin_addr',
+          'subnet', 'digest', 'created')
+
+# Fields filled in by create() rather than taken from the submitted data
+_COMPUTED = ('code', 'digest', 'created')
+
+# Code at least this many bytes long is stored compressed
+COMPRESS_MIN = 1024
+
+# Storage formats of the code field, recorded in the 'format' field.
+# Pastes without the field are plain text.
+FORMAT_PLAIN = ''
+FORMAT_ZLIB = 'zlib1'
+
+# Claim the first free key among the candidates and add its id to the
+# index of pastes from the same subnet.
+# KEYS: candidate paste keys, then the subnet index if known
+# ARGV: ttl, number of candidates, field1, value1, ...
+# Returns the 1-based index of the claimed key or 0 if all are taken.
+_CREATE_LUA = '''
+local count = tonumber(ARGV[2])
+for i = 1, count do
+    local key = KEYS[i]
+    if redis.call('EXISTS', key) == 0 then
+        redis.call('HSET', key, unpack(ARGV, 3))
+        redis.call('EXPIRE', key, ARGV[1])
+        if KEYS[count + 1] then
+            redis.call('SADD', KEYS[count + 1], string.sub(key, 7))
+            redis.call('EXPIRE', KEYS[count + 1], ARGV[1])
+        end
+        return i
+    end
+end
+return 0
+'''
+_create_script = None
+
+# Remove pastes, their rendered copies and everything listed in their
+# derived sets, along with every paste in the given subnet indexes.
+# KEYS: subnet indexes to empty; ARGV: further paste ids
+# Returns {{paste_id, derived key, ...}, ...} for the pastes that existed.
+_DELETE_LUA = '''
+local ids = {}
+for _, index in ipairs(KEYS) do
+    for _, id in ipairs(redis.call('SMEMBERS', index)) do
+        table.insert(ids, id)
+    end
+    redis.call('DEL', index)
+end
+for _, id in ipairs(ARGV) do
+    table.insert(ids, id)
+end
+
+local removed = {}
+for _, id in ipairs(ids) do
+    local key = 'paste:' .. id
+    local subnet = false
+    if redis.call('TYPE', key).ok == 'hash' then
+        subnet = redis.call('HGET', key, 'subnet')
+    end
+    if redis.call('DEL', key, 'render:' .. id) > 0 then
+        local derived = redis.call('SMEMBERS', 'derived:' .. id)
+        for _, d in ipairs(derived) do
+            redis.call('DEL', d)
+        end
+        redis.call('DEL', 'derived:' .. id)
+        if subnet and subnet ~= '' then
+            redis.call('SREM', 'subnet:' .. subnet, id)
+        end
+        table.insert(derived, 1, id)
+        table.insert(removed, derived)
+    end
+end
+return removed
+'''
+_delete_script = None
+
+# Delete a lock only while it still holds the caller's token, so a lock
+# that expired and was taken by another process is left alone.
+# KEYS: lock; ARGV: token
+# Returns 1 if the lock was released.
+_RELEASE_LUA = '''
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+'''
+_release_script = None
+
+# Extra id bytes per requested length, grown as the keyspace fills up
+_extra_length = {}
+
+# Errors meaning Redis could not be reached in time
+UNAVAILABLE = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
+
+# Read replica set up by connect(), and how long to skip it after a failure
+_replica = None
+_replica_retry = 0
+REPLICA_BACKOFF = 30
+
+
+class _TimedClient(redis.StrictRedis):
+    '''
+    Client reporting the time spent waiting on Redis to metrics.
+    '''
+    def execute_command(self, *args, **options):
+        with metrics.stage('redis'):
+            return redis.StrictRedis.execute_command(self, *args, **options)
+
+    def pipeline(self, *args, **kwargs):
+        pipe = redis.StrictRedis.pipeline(self, *args, **kwargs)
+        execute = pipe.execute
+
+        def timed_execute(*args, **kwargs):
+            with metrics.stage('redis'):
+                return execute(*args, **kwargs)
+        pipe.execute = timed_execute
+        return pipe
+
+
+class _Missing(object):
+    '''
+    Returned in place of a paste that does not exist.
+    '''
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __repr__(self):
+        return 'MISSING'
+
+
+MISSING = _Missing()
+
+
+class Paste(object):
+    '''
+    A paste as read back from the cache.
+    '''
+    __slots__ = ('paste_id',) + FIELDS
+
+    def __init__(self, paste_id, fields):
+        self.paste_id = paste_id
+        for name in FIELDS:
+            setattr(self, name, fields.get(name, ''))
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+def connect(conf):
+    '''
+    Returns a client for the primary Redis server in settings.cfg and
+    sets up the read replica, if one is configured.
+    '''
+    global _replica
+    replica_host = conf.get('bottle', 'cache_replica_host')
+    if replica_host:
+        _replica = _client(conf, replica_host, conf.getint('bottle', 'cache_replica_port'))
+    return _client(conf, conf.get('bottle', 'cache_host'), conf.getint('bottle', 'cache_port'),
+                   conf.get('bottle', 'cache_socket'))
+
+
+def _client(conf, host, port, socket_path=''):
+    '''
+    Returns a client with a bounded pool; requests wait up to
+    cache_timeout for a free connection instead of opening more.
+    '''
+    timeout = conf.getfloat('bottle', 'cache_timeout')
+    options = {
+        'db': conf.getint('bottle', 'cache_db'),
+        'password': conf.get('bottle', 'cache_password') or None,
+        'socket_timeout': timeout,
+        'max_connections': conf.getint('bottle', 'cache_pool_size'),
+        'timeout': timeout}
+    if socket_path:
+        pool = redis.BlockingConnectionPool(
+                connection_class=redis.UnixDomainSocketConnection, path=socket_path, **options)
+    else:
+        pool = redis.BlockingConnectionPool(
+                host=host, port=port,
+                socket_connect_timeout=conf.getfloat('bottle', 'cache_connect_timeout'), **options)
+    client_class = _TimedClient if metrics.enabled() else redis.StrictRedis
+    return client_class(connection_pool=pool)
+
+
+def read(cache, command, *args):
+    '''
+    Run a read command on the replica, falling back to the primary when
+    the replica has nothing yet or cannot be reached.
+    '''
+    result = _on_replica(lambda client: getattr(client, command)(*args))
+    if _found(result):
+        return result
+    return getattr(cache, command)(*args)
+
+
+def _on_replica(func):
+    '''
+    Returns func(replica), or None without a usable replica.
+    '''
+    global _replica_retry
+    if _replica is None or time.monotonic() < _replica_retry:
+        return None
+    try:
+        return func(_replica)
+    except UNAVAILABLE as e:
+        print('Read replica unavailable: {}'.format(e))
+        _replica_retry = time.monotonic() + REPLICA_BACKOFF
+        return None
+
+
+def _found(result):
+    if isinstance(result, (list, tuple)):
+        return any(v is not None for v in result)
+    return bool(result)
+
+
+def get(cache, paste_id):
+    '''
+    Fetch a paste in a single round trip.
+    Returns a Paste or MISSING.
+    '''
+    try:
+        fields = read(cache, 'hgetall', 'paste:' + paste_id)
+    except redis.exceptions.ResponseError:
+        fields = _get_legacy(cache, paste_id)
+    if not fields:
+        return MISSING
+
+    fields = {_decode_value(k): v for k, v in fields.items()}
+    code = fields.pop('code', '')
+    fmt = fields.pop('format', None)
+    fields = {k: _decode_value(v) for k, v in fields.items()}
+    fields['code'] = decode_code(code, fmt)
+    return Paste(paste_id, fields)
+
+
+def get_field(cache, paste_id, name):
+    '''
+    Fetch a single field of a paste without loading the rest of it.
+    Returns the value or MISSING.
+    '''
+    try:
+        (value, fmt) = read(cache, 'hmget', 'paste:' + paste_id, name, 'format')
+    except redis.exceptions.ResponseError:
+        (value, fmt) = (_get_legacy(cache, paste_id).get(name), None)
+    if value is None:
+        return MISSING
+    if name == 'code':
+        return decode_code(value, fmt)
+    return _decode_value(value)
+
+
+def get_stored_code(cache, paste_id):
+    '''
+    Fetch the code of a paste as stored, without decompressing it.
+    Returns (value, format) or MISSING.
+    '''
+    try:
+        (value, fmt) = read(cache, 'hmget', 'paste:' + paste_id, 'code', 'format')
+    except redis.exceptions.ResponseError:
+        (value, fmt) = (_get_legacy(cache, paste_id).get('code'), None)
+    if value is None:
+        return MISSING
+    if isinstance(value, str):
+        value = value.encode('utf-8')
+    return (value, _decode_value(fmt) or FORMAT_PLAIN)
+
+
+def get_validators(cache, *paste_ids):
+    '''
+    Fetch what is needed to answer conditional requests for pastes,
+    in one round trip and without loading any code.
+    Returns a list of (digest, created, private) or MISSING per paste;
+    pastes written before digests were stored have an empty digest.
+    '''
+    results = _on_replica(lambda client: _validators(client, paste_ids))
+    if results is None or MISSING in results:
+        results = _validators(cache, paste_ids)
+    return results
+
+
+def _validators(cache, paste_ids):
+    pipe = cache.pipeline(transaction=False)
+    for paste_id in paste_ids:
+        pipe.hmget('paste:' + paste_id, 'digest', 'created', 'private')
+    results = []
+    for values in pipe.execute(raise_on_error=False):
+        if isinstance(values, redis.exceptions.ResponseError):
+            # Legacy json paste
+            results.append(('', '', ''))
+        elif values[0] is None and values[2] is None:
+            results.append(MISSING)
+        else:
+            results.append(tuple(_decode_value(v) or '' for v in values))
+    return results
+
+
+def content_digest(code):
+    '''
+    Returns a short hash of the code of a paste.
+    '''
+    return hashlib.sha1(code.encode('utf-8')).hexdigest()[:16]
+
+
+def encode_code(code):
+    '''
+    Returns (value, format) for storing the code of a paste.
+    '''
+    raw = code.encode('utf-8')
+    if len(raw) >= COMPRESS_MIN:
+        packed = zlib.compress(raw, 6)
+        if len(packed) < len(raw):
+            return (packed, FORMAT_ZLIB)
+    return (raw, FORMAT_PLAIN)
+
+
+def decode_code(value, fmt):
+    '''
+    Returns the code of a paste as text from its stored form.
+    '''
+    fmt = _decode_value(fmt) or FORMAT_PLAIN
+    if fmt == FORMAT_ZLIB:
+        value = zlib.decompress(value)
+    elif fmt != FORMAT_PLAIN:
+        raise ValueError('Unknown paste format: {}'.format(fmt))
+    return _decode_value(value)
+
+
+def create(cache, data, id_length):
+    '''
+    Store a new paste under a random unused id; only known fields are kept.
+    With a subnet digest in data the id is also added to that subnet's index.
+    Returns paste_id.
+    '''
+    global _create_script
+    if _create_script is None:
+        _create_script = cache.register_script(_CREATE_LUA)
+
+    (code, fmt) = encode_code(data.get('code', ''))
+    args = [PASTE_TTL, 0, 'code', code, 'format', fmt,
+            'digest', content_digest(data.get('code', '')),
+            'created', int(time.time())]
+    for k in FIELDS:
+        if k not in _COMPUTED:
+            args.extend((k, data.get(k, '')))
+
+    while True:
+        extra = _extra_length.get(id_length, 0)
+        candidates = _candidates(id_length + extra, extra > 0)
+        keys = ['paste:' + c for c in candidates]
+        args[1] = len(keys)
+        if data.get('subnet'):
+            keys.append('subnet:' + data['subnet'])
+        index = _create_script(keys=keys, args=args, client=cache)
+        if index:
+            break
+        _extra_length[id_length] = extra + 1
+
+    # Collisions estimate how full the keyspace is: two misses at the
+    # current length means it is getting crowded, while a hit on the
+    # shorter probe means it has drained again.
+    if extra and index == 1:
+        _extra_length[id_length] = extra - 1
+    elif index > (3 if extra else 2):
+        _extra_length[id_length] = extra + 1
+
+    return candidates[index - 1]
+
+
+def _candidates(length, probe_shorter):
+    '''
+    Returns ids to try in order, mostly at the given length.
+    '''
+    lengths = [length] * 3 + [length + 1] * 2
+    if probe_shorter:
+        lengths.insert(0, length - 1)
+    return [binascii.b2a_hex(os.urandom(n)).decode('utf-8') for n in lengths]
+
+
+def put_derived(cache, key, value, *paste_ids):
+    '''
+    Cache a value computed from one or more pastes.
+    It expires with the first of them and is removed when any is deleted.
+    A dict value is stored as a hash.
+    Returns False if a paste is already gone.
+    '''
+    pipe = cache.pipeline(transaction=False)
+    for paste_id in paste_ids:
+        pipe.ttl('paste:' + paste_id)
+    ttl = min(t if t != -1 else PASTE_TTL for t in pipe.execute())
+    if ttl <= 0:
+        return False
+
+    pipe = cache.pipeline()
+    if isinstance(value, dict):
+        pipe.delete(key)
+        pipe.hset(key, mapping=value)
+        pipe.expire(key, ttl)
+    else:
+        pipe.setex(key, ttl, value)
+    for paste_id in paste_ids:
+        pipe.sadd('derived:' + paste_id, key)
+        pipe.expire('derived:' + paste_id, PASTE_TTL)
+    pipe.execute()
+    return True
+
+
+def delete(cache, paste_id):
+    '''
+    Remove a paste and everything derived from it.
+    Returns the derived keys that were removed, or None if the paste did not exist.
+    '''
+    return delete_many(cache, [paste_id]).get(paste_id)
+
+
+def delete_many(cache, paste_ids=(), subnets=()):
+    '''
+    Remove pastes, and every paste written from the given subnet digests,
+    with everything derived from them in one round trip.
+    Returns {paste_id: derived keys removed} for the pastes that existed.
+    '''
+    global _delete_script
+    if _delete_script is None:
+        _delete_script = cache.register_script(_DELETE_LUA)
+    keys = ['subnet:' + s for s in subnets]
+    result = _delete_script(keys=keys, args=list(paste_ids), client=cache)
+    return {_decode_value(r[0]): [_decode_value(k) for k in r[1:]] for r in result}
+
+
+def get_subnets(cache, *paste_ids):
+    '''
+    Fetch the subnet digest and origin address of pastes in one round trip.
+    Returns a list of (subnet, origin_addr) or MISSING per paste; pastes
+    written before subnets were recorded have an empty subnet.
+    '''
+    pipe = cache.pipeline(transaction=False)
+    for paste_id in paste_ids:
+        pipe.hmget('paste:' + paste_id, 'subnet', 'origin_addr')
+    results = []
+    for (paste_id, values) in zip(paste_ids, pipe.execute(raise_on_error=False)):
+        if isinstance(values, redis.exceptions.ResponseError):
+            addr = _get_legacy(cache, paste_id).get('origin_addr')
+            results.append(('', addr) if addr else MISSING)
+        elif values[1] is None:
+            results.append(MISSING)
+        else:
+            results.append(tuple(_decode_value(v) or '' for v in values))
+    return results
+
+
+def acquire_lock(cache, key, ttl):
+    '''
+    Take a lock for up to ttl seconds.
+    Returns the token needed to release it, or None if it is held elsewhere.
+    '''
+    token = binascii.b2a_hex(os.urandom(16)).decode('utf-8')
+    if cache.set(key, token, nx=True, ex=ttl):
+        return token
+    return None
+
+
+def release_lock(cache, key, token):
+    '''
+    Release a lock taken with acquire_lock() if it is still ours.
+    Returns True if it was.
+    '''
+    global _release_script
+    if _release_script is None:
+        _release_script = cache.register_script(_RELEASE_LUA)
+    return bool(_release_script(keys=[key], args=[token], client=cache))
+
+
+def _get_legacy(cache, paste_id):
+    '''
+    Read a paste written as a json string by older versions.
+    '''
+    value = cache.get('paste:' + paste_id)
+    if not value:
+        return {}
+    return json.loads(value)
+
+
+def _decode_value(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
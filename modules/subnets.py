@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+
+import ipaddress
+
+
+class SubnetTable(object):
+    '''
+    Longest-prefix lookup of the announced subnet an address belongs to.
+
+    Networks are kept in one hash table per prefix length, so a lookup
+    costs at most one probe per distinct prefix length in the table.
+    '''
+    def __init__(self):
+        # version -> {prefix length -> {network as int -> 'net/len'}}
+        self._nets = {4: {}, 6: {}}
+        self._lengths = {4: [], 6: []}
+
+    def __len__(self):
+        return sum(len(nets) for v in self._nets.values() for nets in v.values())
+
+    def add(self, prefix):
+        '''
+        Add a prefix such as '192.0.2.0/24'.
+        '''
+        net = ipaddress.ip_network(prefix, strict=False)
+        by_length = self._nets[net.version]
+        if net.prefixlen not in by_length:
+            by_length[net.prefixlen] = {}
+            self._lengths[net.version] = sorted(by_length, reverse=True)
+        by_length[net.prefixlen][int(net.network_address)] = str(net)
+
+    def lookup(self, addr):
+        '''
+        Returns the most specific prefix containing addr, or None.
+        '''
+        try:
+            ip = ipaddress.ip_address(addr)
+        except ValueError:
+            return None
+        if ip.version == 6 and ip.ipv4_mapped:
+            ip = ip.ipv4_mapped
+
+        value = int(ip)
+        bits = ip.max_prefixlen
+        by_length = self._nets[ip.version]
+        for length in self._lengths[ip.version]:
+            mask = ((1 << length) - 1) << (bits - length)
+            prefix = by_length[length].get(value & mask)
+            if prefix:
+                return prefix
+        return None
+
+
+def load(path):
+    '''
+    Build a SubnetTable from a prefix dump.
+
+    Each line holds either a CIDR prefix ('192.0.2.0/24 ...') or an address
+    and length pair as in CAIDA pfx2as files ('192.0.2.0<TAB>24<TAB>64496').
+    Anything after the prefix is ignored, as are blank lines and comments.
+    '''
+    table = SubnetTable()
+    with open(path) as f:
+        for line in f:
+            fields = line.split('#', 1)[0].split()
+            if not fields:
+                continue
+            if '/' in fields[0]:
+                prefix = fields[0]
+            elif len(fields) > 1 and fields[1].isdigit():
+                prefix = '{}/{}'.format(fields[0], fields[1])
+            else:
+                continue
+            try:
+                table.add(prefix)
+            except ValueError:
+                continue
+    return table
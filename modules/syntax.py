@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# local imports
+from . import kwlinker
+
+from pygments import highlight
+from pygments.formatters import HtmlFormatter
+
+import copy
+import importlib
+import threading
+
+# Syntax names offered by paste.html, mapped to the lexer implementing them.
+# Lexer modules are only imported the first time a syntax is rendered.
+SYNTAXES = {
+    'nginx': ('pygments.lexers.configs', 'NginxConfLexer'),
+    'html': ('pygments.lexers.html', 'HtmlLexer'),
+    'text': ('pygments.lexers.special', 'TextLexer'),
+    'apache': ('pygments.lexers.configs', 'ApacheConfLexer'),
+    'bash': ('pygments.lexers.shell', 'BashLexer'),
+    'c': ('pygments.lexers.c_cpp', 'CLexer'),
+    'css': ('pygments.lexers.css', 'CssLexer'),
+    'javascript': ('pygments.lexers.javascript', 'JavascriptLexer'),
+    'lua': ('pygments.lexers.scripting', 'LuaLexer'),
+    'mysql': ('pygments.lexers.sql', 'MySqlLexer'),
+    # Pygments has no pcre lexer
+    'pcre': ('pygments.lexers.special', 'TextLexer'),
+    'perl': ('pygments.lexers.perl', 'PerlLexer'),
+    'php': ('pygments.lexers.php', 'PhpLexer'),
+    'postgresql': ('pygments.lexers.sql', 'PostgresLexer'),
+    'python': ('pygments.lexers.python', 'PythonLexer'),
+    'ruby': ('pygments.lexers.ruby', 'RubyLexer'),
+    'sql': ('pygments.lexers.sql', 'SqlLexer'),
+    'xml': ('pygments.lexers.html', 'XmlLexer'),
+}
+
+_lexer_classes = {}
+_formatter = None
+_lock = threading.Lock()
+
+# Escapes applied to token text, as by HtmlFormatter
+_ESCAPE = {ord('&'): '&amp;', ord('<'): '&lt;', ord('>'): '&gt;', ord('"'): '&quot;', ord("'"): '&#39;'}
+
+
+class HtmlLineFormatter(HtmlFormatter):
+    '''
+    Output as html and wrap each line in a span.
+    A copy made by with_links() links keywords as it formats them.
+    '''
+    name = 'Html with line wrap'
+    aliases = ['htmlline']
+    links = None
+
+    def __init__(self, **options):
+        HtmlFormatter.__init__(self, **options)
+        # Opening tag per token type, shared with copies
+        self._spans = {}
+
+    def with_links(self, links):
+        '''
+        Returns a copy of this formatter linking tokens listed in a kwlinker table.
+        '''
+        linked = copy.copy(self)
+        linked.links = links
+        return linked
+
+    def _format_lines(self, tokensource):
+        # Stands in for HtmlFormatter._format_lines with the options used here
+        # (css classes, no ctags), so link markup goes straight into the lines
+        links = self.links or {}
+        # Markup of linked token types per value, as most recur many times
+        linked = {}
+        spans = self._spans
+        lsep = self.lineseparator
+        lspan = ''
+        line = []
+        for ttype, value in tokensource:
+            cspan = spans.get(ttype)
+            if cspan is None:
+                css_class = self._get_css_classes(ttype)
+                cspan = spans[ttype] = '<span class="%s">' % css_class if css_class else ''
+
+            if ttype in links:
+                key = (ttype, value)
+                markup = linked.get(key)
+                if markup is None:
+                    markup = linked[key] = (kwlinker.link(links, ttype, value)
+                                            or value.translate(_ESCAPE))
+            else:
+                markup = value.translate(_ESCAPE)
+            if '\n' not in markup:
+                # Most tokens lie within a line
+                if markup:
+                    if not line:
+                        line = [cspan, markup]
+                        lspan = cspan
+                    elif lspan != cspan:
+                        line.extend(((lspan and '</span>'), cspan, markup))
+                        lspan = cspan
+                    else:
+                        line.append(markup)
+                continue
+
+            parts = markup.split('\n')
+            for part in parts[:-1]:
+                if line:
+                    if lspan != cspan and part:
+                        line.extend(((lspan and '</span>'), cspan, part, (cspan and '</span>'), lsep))
+                    else:
+                        line.extend((part, (lspan and '</span>'), lsep))
+                    yield 1, ''.join(line)
+                    line = []
+                elif part:
+                    yield 1, ''.join((cspan, part, (cspan and '</span>'), lsep))
+                else:
+                    yield 1, lsep
+            if parts[-1]:
+                line = [cspan, parts[-1]]
+                lspan = cspan
+
+        if line:
+            line.extend(((lspan and '</span>'), lsep))
+            yield 1, ''.join(line)
+
+    def wrap(self, source, *args):
+        # Pygments before 2.12 also passes outfile
+        return self._wrap_div(self._wrap_pre(self._wrap_lines(source)))
+
+    def _wrap_lines(self, source):
+        i = self.linenostart
+        for t, line in source:
+            if t == 1:
+                line = '<span class="linecount" id="LC%d">%s</span>' % (i, line)
+                i += 1
+            yield t, line
+
+
+def normalize(name):
+    '''
+    Returns name if it is a known syntax, otherwise plain text.
+    '''
+    return name if name in SYNTAXES else 'text'
+
+
+def get_lexer(name):
+    '''
+    Returns a new lexer instance for a syntax name.
+    '''
+    name = normalize(name)
+    cls = _lexer_classes.get(name)
+    if cls is None:
+        (module, attr) = SYNTAXES[name]
+        cls = getattr(importlib.import_module(module), attr)
+        _lexer_classes[name] = cls
+    return cls(stripall=False)
+
+
+def get_formatter():
+    '''
+    Returns the shared formatter used for paste pages.
+    '''
+    global _formatter
+    if _formatter is None:
+        with _lock:
+            if _formatter is None:
+                _formatter = HtmlLineFormatter(linenos=True, cssclass="paste")
+    return _formatter
+
+
+def warm():
+    '''
+    Import every lexer and set up the formatter and link tables now.
+    Under gevent this has to run on the event loop: the locks guarding the
+    lazy loading are then gevent locks, which pool threads can't take safely.
+    '''
+    for name in SYNTAXES:
+        render('x\n', name)
+    kwlinker.warm()
+
+
+def render(code, name):
+    '''
+    Returns highlighted html for code in the given syntax.
+    '''
+    lexer = get_lexer(name)
+    links = kwlinker.get_links(normalize(name))
+    if links is None:
+        return highlight(code, lexer, get_formatter())
+    return highlight(code, lexer, get_formatter().with_links(links))
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
+import collections
 import hashlib
+import threading
+import time
 
 
 def str2bool(v):
@@ -22,3 +25,36 @@ def sha512(v):
     Returns a sha512 checksum for provided value.
     '''
     return hashlib.sha512(v.encode('utf-8')).hexdigest()
+
+
+class LRUCache(object):
+    '''
+    Small least-recently-used cache whose entries also expire after ttl seconds.
+    '''
+    def __init__(self, maxsize=1024, ttl=3600):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            if item[0] < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
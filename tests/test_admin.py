@@ -0,0 +1,81 @@
+import pytest
+
+pytest.importorskip('bottle')
+pytest.importorskip('cymruwhois')
+pytest.importorskip('requests')
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')
+
+from modules import admin  # noqa: E402
+from modules import caching  # noqa: E402
+from modules import sanity  # noqa: E402
+from modules import store  # noqa: E402
+
+# Subnet digests of the addresses the tests know about
+SUBNETS = {'192.0.2.1': 'net-a', '192.0.2.2': 'net-a', '198.51.100.1': 'net-b'}
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(store, '_replica', None)
+    monkeypatch.setattr(sanity, 'address_digest', lambda addr, whois=True: SUBNETS.get(addr))
+    return fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+
+
+@pytest.fixture
+def purged(monkeypatch):
+    calls = []
+    monkeypatch.setattr(caching, 'purge', lambda conf, removed: calls.append(removed))
+    return calls
+
+
+def _paste(cache, addr, code='x'):
+    return store.create(cache, {'code': code, 'origin_addr': addr, 'subnet': SUBNETS.get(addr, '')}, 4)
+
+
+def test_delete_many_removes_subnets_and_derived_keys(cache):
+    (a1, a2, b1) = [_paste(cache, addr) for addr in ('192.0.2.1', '192.0.2.2', '198.51.100.1')]
+    store.put_derived(cache, 'diff:{}:{}:full'.format(b1, a1), 'table', b1, a1)
+
+    removed = store.delete_many(cache, [b1, 'gone'], ['net-a'])
+    assert sorted(removed) == sorted([a1, a2, b1])
+    assert removed[a1] == removed[b1] == ['diff:{}:{}:full'.format(b1, a1)]
+    assert all(store.get(cache, p) is store.MISSING for p in (a1, a2, b1))
+    assert not cache.exists('subnet:net-a')
+    assert store.delete_many(cache, [], ['net-a']) == {}
+
+
+def test_delete_batch_mixes_addresses_and_paste_ids(cache, purged):
+    (a1, a2, b1) = [_paste(cache, addr) for addr in ('192.0.2.1', '192.0.2.2', '198.51.100.1')]
+    other = _paste(cache, '203.0.113.9')
+
+    resp = admin._cmd_delete_batch(None, cache, {'targets': [' 192.0.2.1 ', b1, 'gone', '203.0.113.1']})
+    assert resp['status'] == 'success'
+    assert resp['removed'] == sorted([a1, a2, b1])
+    assert resp['unresolved'] == ['203.0.113.1', 'gone']
+    assert purged == [{a1: [], a2: [], b1: []}]
+    assert store.get(cache, other) is not store.MISSING
+
+
+def test_delete_batch_without_targets(cache, purged):
+    assert admin._cmd_delete_batch(None, cache, {'targets': 'abc'})['status'] == 'error'
+    resp = admin._cmd_delete_batch(None, cache, {'targets': ['gone']})
+    assert (resp['removed'], resp['unresolved']) == ([], ['gone'])
+    assert purged == []
+
+
+def test_blacklist_batch(cache, purged):
+    (a1, a2, b1) = [_paste(cache, addr) for addr in ('192.0.2.1', '192.0.2.2', '198.51.100.1')]
+    # Written before subnets were recorded, so only its address is known
+    legacy = _paste(cache, '198.51.100.1')
+    cache.hset('paste:' + legacy, 'subnet', '')
+    other = _paste(cache, '203.0.113.9')
+
+    resp = admin._cmd_blacklist_batch(None, cache, {'targets': ['192.0.2.2', legacy, 'gone', '2001:db8::1']})
+    assert resp['status'] == 'success'
+    assert resp['message'] == 'Blacklisted 2 subnet(s); 4 paste(s) removed.'
+    assert resp['removed'] == sorted([a1, a2, b1, legacy])
+    assert resp['unresolved'] == ['2001:db8::1', 'gone']
+    assert cache.exists('ipblock:net-a') and cache.exists('ipblock:net-b')
+    assert sorted(purged[0]) == sorted([a1, a2, b1, legacy])
+    assert store.get(cache, other) is not store.MISSING
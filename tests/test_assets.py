@@ -0,0 +1,81 @@
+import gzip
+
+import pytest
+
+bottle = pytest.importorskip('bottle')
+
+from modules import assets  # noqa: E402
+
+CSS = 'body { color: #333; }\n' * 50
+
+
+@pytest.fixture
+def manifest():
+    manifest = assets.Manifest()
+    manifest.add('css/site.css', CSS)
+    return manifest
+
+
+def _serve(manifest, filename, **headers):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/static/' + filename}
+    environ.update(('HTTP_' + name.upper(), value) for (name, value) in headers.items())
+    bottle.request.bind(environ)
+    return manifest.serve(filename)
+
+
+def test_urls_are_content_hashed(manifest):
+    url = manifest.url('css/site.css')
+    assert url.startswith('/static/css/site.') and url.endswith('.css')
+    assert url != '/static/css/site.css'
+    assert manifest.url('missing.js') == '/static/missing.js'
+
+    version = manifest.version()
+    manifest.add('css/site.css', CSS + 'p {}\n')
+    assert manifest.url('css/site.css') != url
+    assert manifest.version() != version
+
+
+def test_hashed_and_plain_names(manifest):
+    hashed = manifest.url('css/site.css')[len('/static/'):]
+    response = _serve(manifest, hashed)
+    assert response.status_code == 200
+    assert response.headers['Cache-Control'] == assets.IMMUTABLE
+    assert response.headers['Content-Type'] == 'text/css; charset=utf-8'
+    assert response.body == CSS.encode('utf-8')
+    assert _serve(manifest, 'css/site.css').headers['Cache-Control'] == assets.MUTABLE
+
+
+def test_compressed_variant(manifest):
+    response = _serve(manifest, 'css/site.css', accept_encoding='gzip')
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.body) == CSS.encode('utf-8')
+    response = _serve(manifest, 'css/site.css', accept_encoding='gzip;q=0')
+    assert 'Content-Encoding' not in response.headers
+    assert response.body == CSS.encode('utf-8')
+
+
+def test_negotiate():
+    available = {'identity': b'', 'gzip': b'', 'br': b''}
+    assert assets.negotiate('gzip, deflate, br', available) == 'br'
+    assert assets.negotiate('gzip, br;q=0', available) == 'gzip'
+    assert assets.negotiate('br;q=0.0, gzip;q=0.5', available) == 'gzip'
+    assert assets.negotiate('*', available) == 'br'
+    assert assets.negotiate('*, br;q=0', available) == 'gzip'
+    assert assets.negotiate('*;q=0', available) == 'identity'
+    assert assets.negotiate('', available) == 'identity'
+    assert assets.negotiate('GZIP', {'identity': b'', 'gzip': b''}) == 'gzip'
+    assert assets.negotiate('br', {'identity': b'', 'gzip': b''}) == 'identity'
+
+
+def test_not_modified_on_etag(manifest):
+    etag = _serve(manifest, 'css/site.css').headers['ETag']
+    response = _serve(manifest, 'css/site.css', if_none_match='"other", ' + etag)
+    assert response.status_code == 304
+    assert response.headers['ETag'] == etag
+    assert _serve(manifest, 'css/site.css', if_none_match='"other"').status_code == 200
+
+
+def test_unknown_file_is_404(manifest):
+    assert _serve(manifest, 'css/missing.css').status_code == 404
+    assert _serve(manifest, 'css/site.000000000000.css').status_code == 404
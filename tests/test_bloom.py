@@ -0,0 +1,47 @@
+import hashlib
+import time
+
+import pytest
+
+from modules import bloom
+
+
+def _digest(value):
+    return hashlib.sha512(value.encode('utf-8')).hexdigest()
+
+
+def _wait_for(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+def test_bloom_filter_membership():
+    f = bloom.BloomFilter(size=1 << 16)
+    f.add(_digest('192.0.2.0/24'))
+    assert _digest('192.0.2.0/24') in f
+    assert sum(_digest('net{}'.format(n)) in f for n in range(1000)) < 10
+
+
+def test_list_filter_survives_malformed_messages():
+    fakeredis = pytest.importorskip('fakeredis')
+    cache = fakeredis.FakeStrictRedis()
+    listed = _digest('198.51.100.0/24')
+
+    lists = bloom.ListFilter(cache)
+    assert lists.might_contain(listed)
+    assert _wait_for(lambda: lists._filter is not None)
+    assert not lists.might_contain(listed)
+
+    # Listed without an announcement, so only a rebuild will pick it up
+    cache.set('ipblock:' + listed, 'nil')
+    cache.publish(bloom.CHANNEL, 'garbage')
+
+    # Until it has been rebuilt every lookup goes to Redis
+    assert _wait_for(lambda: lists._filter is None)
+    assert lists.might_contain(listed)
+    assert _wait_for(lambda: lists._filter is not None)
+    assert lists.might_contain(listed)
@@ -0,0 +1,144 @@
+import configparser
+import email.utils
+import http.server
+import threading
+
+import pytest
+
+bottle = pytest.importorskip('bottle')
+pytest.importorskip('redis')
+pytest.importorskip('requests')
+fakeredis = pytest.importorskip('fakeredis')
+
+from modules import caching  # noqa: E402
+from modules import store  # noqa: E402
+
+CREATED = 1500000000
+
+
+class _PurgeHandler(http.server.BaseHTTPRequestHandler):
+    def do_PURGE(self):
+        self.server.seen.append((self.command, self.path, self.headers.get('Surrogate-Key')))
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def purge_server():
+    server = http.server.HTTPServer(('127.0.0.1', 0), _PurgeHandler)
+    server.seen = []
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _conf(url='', by_key=False):
+    conf = configparser.ConfigParser()
+    conf['bottle'] = {'purge_url': url, 'purge_method': 'PURGE',
+                      'purge_by_key': str(by_key), 'purge_file': '',
+                      'cache_max_age': '60', 'proxy_cache_ttl': '0'}
+    return conf
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(store, '_replica', None)
+    client = fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+    client.hset('paste:pub', mapping={'digest': 'aaaa', 'created': CREATED, 'private': '0'})
+    client.hset('paste:priv', mapping={'digest': 'bbbb', 'created': CREATED + 10, 'private': '1'})
+    return client
+
+
+def _request(**headers):
+    environ = {'REQUEST_METHOD': 'GET', 'PATH_INFO': '/'}
+    environ.update(('HTTP_' + name.upper(), value) for (name, value) in headers.items())
+    bottle.request.bind(environ)
+    bottle.response.bind()
+
+
+def _check(cache, paste_ids, **headers):
+    '''
+    Returns the status and headers check_pastes answers a request with.
+    '''
+    _request(**headers)
+    try:
+        caching.check_pastes(_conf(), cache, paste_ids, 'v1')
+    except bottle.HTTPResponse as e:
+        return (e.status_code, e.headers)
+    return (bottle.response.status_code, bottle.response.headers)
+
+
+def test_check_pastes_sets_validators(cache):
+    (status, headers) = _check(cache, ['pub'])
+    assert status == 200
+    assert headers['ETag'] == '"v1-aaaa"'
+    assert headers['Cache-Control'] == 'public, max-age=60'
+    assert headers['Last-Modified'] == email.utils.formatdate(CREATED, usegmt=True)
+    assert headers['Surrogate-Key'] == 'paste-pub'
+
+
+def test_check_pastes_private_if_any_paste_is(cache):
+    (status, headers) = _check(cache, ['pub', 'priv'])
+    assert headers['ETag'] == '"v1-aaaa-bbbb"'
+    assert headers['Cache-Control'] == 'private, max-age=60'
+    assert headers['Last-Modified'] == email.utils.formatdate(CREATED + 10, usegmt=True)
+
+
+def test_check_pastes_if_none_match(cache):
+    assert _check(cache, ['pub'], if_none_match='"v1-aaaa"')[0] == 304
+    assert _check(cache, ['pub'], if_none_match='"other", "v1-aaaa"')[0] == 304
+    assert _check(cache, ['pub'], if_none_match='W/"v1-aaaa"')[0] == 304
+    assert _check(cache, ['pub'], if_none_match='*')[0] == 304
+    assert _check(cache, ['pub'], if_none_match='"other", W/"v2-aaaa"')[0] == 200
+    (status, headers) = _check(cache, ['priv'], if_none_match='"v1-bbbb"')
+    assert status == 304
+    assert headers['Cache-Control'] == 'private, max-age=60'
+
+
+def test_check_pastes_if_modified_since(cache):
+    assert _check(cache, ['pub'], if_modified_since=email.utils.formatdate(CREATED, usegmt=True))[0] == 304
+    assert _check(cache, ['pub'], if_modified_since=email.utils.formatdate(CREATED - 1, usegmt=True))[0] == 200
+    # If-None-Match takes precedence
+    assert _check(cache, ['pub'], if_none_match='"other"',
+                  if_modified_since=email.utils.formatdate(CREATED, usegmt=True))[0] == 200
+
+
+def test_check_pastes_skips_missing_pastes(cache):
+    (status, headers) = _check(cache, ['pub', 'gone'], if_none_match='*')
+    assert status == 200
+    assert 'ETag' not in headers
+
+
+def test_not_modified_without_validators():
+    _request()
+    assert not caching.not_modified('"x"', CREATED)
+    _request(if_modified_since='garbage')
+    assert not caching.not_modified('"x"', CREATED)
+    _request(if_modified_since=email.utils.formatdate(CREATED, usegmt=True))
+    assert not caching.not_modified('"x"')
+
+
+def test_paste_paths_cover_every_route():
+    paths = caching.paste_paths('abc', ['diff:orig:abc:full', 'diff:orig:abc:5', 'page:abc:v1'])
+    assert paths == ['/abc', '/r/abc', '/f/abc', '/d/orig/abc', '/d/orig/abc?context=5']
+
+
+def test_purge_by_path(purge_server):
+    url = 'http://127.0.0.1:{}/purge{{path}}'.format(purge_server.server_port)
+    caching.purge(_conf(url), {'abc': ['diff:orig:abc:full']})
+    assert [p for (_, p, _) in purge_server.seen] == [
+        '/purge/abc', '/purge/r/abc', '/purge/f/abc', '/purge/d/orig/abc']
+
+
+def test_purge_by_key(purge_server):
+    url = 'http://127.0.0.1:{}/purge/{{key}}'.format(purge_server.server_port)
+    caching.purge(_conf(url, by_key=True), {'abc': ['diff:orig:abc:3'], 'def': []})
+    assert sorted(purge_server.seen) == [
+        ('PURGE', '/purge/paste-abc', 'paste-abc'),
+        ('PURGE', '/purge/paste-def', 'paste-def')]
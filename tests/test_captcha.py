@@ -0,0 +1,43 @@
+import pytest
+
+pytest.importorskip('requests')
+
+from modules import captcha  # noqa: E402
+
+
+class _Response(object):
+    def __init__(self, success):
+        self.success = success
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return {'success': self.success}
+
+
+def _verifier(monkeypatch, success):
+    verifier = captcha.Verifier(url='http://captcha.invalid/')
+    posts = []
+
+    def post(url, data, timeout):
+        posts.append(data)
+        return _Response(success)
+    monkeypatch.setattr(verifier._session, 'post', post)
+    return (verifier, posts)
+
+
+def test_accepted_answers_are_not_reused(monkeypatch):
+    (verifier, posts) = _verifier(monkeypatch, True)
+    assert verifier.verify('secret', 'answer', '192.0.2.1')
+    assert verifier.verify('secret', 'answer', '192.0.2.1')
+    assert len(posts) == 2
+    assert posts[0]['remoteip'] == '192.0.2.1'
+
+
+def test_rejected_answers_are_cached(monkeypatch):
+    (verifier, posts) = _verifier(monkeypatch, False)
+    assert not verifier.verify('secret', 'answer')
+    assert not verifier.verify('secret', 'answer')
+    assert len(posts) == 1
+    assert 'remoteip' not in posts[0]
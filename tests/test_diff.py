@@ -0,0 +1,32 @@
+from modules import diff
+
+
+def _pair(lines):
+    a = ['line {}'.format(n) for n in range(lines)]
+    b = list(a)
+    b[lines // 2] = 'changed'
+    return (a, b)
+
+
+def _hunk_lines(html):
+    return [line for line in html.split('\n') if line[:1] in (' ', '-', '+') and not line.startswith(('---', '+++'))]
+
+
+def test_opcodes_cover_both_sides():
+    (a, b) = _pair(50)
+    codes = diff.opcodes(a, b)
+    assert codes[0][1] == 0 and codes[-1][2] == len(a)
+    assert [c for c in codes if c[0] != 'equal'] == [('replace', 25, 26, 25, 26)]
+
+
+def test_unified_honours_context():
+    (a, b) = _pair(diff.TABLE_MAX_LINES + 10)
+    assert len(_hunk_lines(diff.render(a, b, 'a', 'b'))) == 2 + 2 * diff.UNIFIED_CONTEXT
+    assert len(_hunk_lines(diff.render(a, b, 'a', 'b', context=10))) == 2 + 2 * 10
+    assert len(_hunk_lines(diff.render(a, b, 'a', 'b', context=10 ** 6))) == 2 + 2 * diff.MAX_CONTEXT
+
+
+def test_table_honours_context():
+    (a, b) = _pair(1000)
+    html = diff.render(a, b, 'a', 'b', context=5)
+    assert html.count('<tr><td class="diff_header">') == 1 + 2 * 5
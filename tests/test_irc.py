@@ -0,0 +1,69 @@
+import pytest
+
+pytest.importorskip('redis')
+
+from modules import irc  # noqa: E402
+
+
+class _Socket(object):
+    '''
+    Accepts up to `limit` bytes, then fails like a dropped connection.
+    '''
+    def __init__(self, received, limit=None):
+        self.received = received
+        self.limit = limit
+
+    def send(self, data):
+        if self.limit is not None and self.limit <= 0:
+            raise ConnectionResetError()
+        data = bytes(data)
+        if self.limit is not None:
+            data = data[:self.limit]
+            self.limit -= len(data)
+        self.received.append(data)
+        return len(data)
+
+    def close(self):
+        pass
+
+
+def test_partial_send_does_not_repeat_lines(monkeypatch):
+    received = []
+    sockets = [_Socket(received, limit=16), _Socket(received)]
+    monkeypatch.setattr(irc.socket, 'create_connection', lambda *a, **k: sockets.pop(0))
+    monkeypatch.setattr(irc.time, 'sleep', lambda s: None)
+
+    relay = irc.Relay('127.0.0.1', 1)
+    relay._send(b'a;pw;first\nb;pw;second\nc;pw;third\n', 3)
+
+    # The first line went out whole, the cut second line is sent again
+    assert b''.join(received) == b'a;pw;first\nb;pw;' + b'b;pw;second\nc;pw;third\n'
+    assert (relay.sent, relay.failed) == (3, 0)
+
+
+def test_failed_lines_are_counted(monkeypatch):
+    received = []
+    monkeypatch.setattr(irc.socket, 'create_connection', lambda *a, **k: _Socket(received, limit=0))
+    monkeypatch.setattr(irc.time, 'sleep', lambda s: None)
+
+    relay = irc.Relay('127.0.0.1', 1, retries=2)
+    relay._send(b'a;pw;first\nb;pw;second\n', 2)
+    assert (relay.sent, relay.failed) == (0, 2)
+
+
+def test_thread_starts_with_the_first_line_in_each_process(monkeypatch):
+    started = []
+    monkeypatch.setattr(irc.threading.Thread, 'start', lambda self: started.append(self.name))
+    relay = irc.Relay('127.0.0.1', 1)
+    assert started == []
+
+    relay.enqueue('a;pw;first\n')
+    relay.enqueue('a;pw;second\n')
+    assert started == ['pbin-relay']
+    assert relay.depth == 2
+
+    # A forked worker gets a thread and queue of its own
+    monkeypatch.setattr(irc.os, 'getpid', lambda: -1)
+    relay.enqueue('a;pw;third\n')
+    assert started == ['pbin-relay', 'pbin-relay']
+    assert relay.depth == 1
@@ -0,0 +1,32 @@
+import importlib.util
+import os
+
+from conftest import ROOT
+
+from modules import kwlinker
+from modules import syntax
+
+
+def test_nginx_variables_link_to_their_docs():
+    html = syntax.render('proxy_set_header Host $host;\nreturn 302 /?p=$arg_page;\n', 'nginx')
+    assert ('<a href="https://nginx.org/en/docs/http/ngx_http_core_module.html#var_host"'
+            ' target="_blank">$host</a>') in html
+    assert ('<a href="https://nginx.org/en/docs/http/ngx_http_core_module.html#var_arg_"'
+            ' target="_blank">$arg_page</a>') in html
+
+
+def test_unknown_nginx_words_are_not_linked():
+    html = syntax.render('frobnicate_buffers 4 8k;\nset $mine 1;\n', 'nginx')
+    assert '<span class="k">frobnicate_buffers</span>' in html
+    assert '<span class="nv">$mine</span>' in html
+    table = kwlinker.get_links('nginx')
+    assert all(t.get('frobnicate_buffers') is None and t.get('$mine') is None for t in table.values())
+
+
+def test_nginx_links_header_matches_the_tool():
+    spec = importlib.util.spec_from_file_location(
+        'build_nginx_links', os.path.join(ROOT, 'tools', 'build_nginx_links.py'))
+    tool = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tool)
+    with open(os.path.join(ROOT, 'modules', 'kwlinker', 'nginx.links'), encoding='utf-8') as f:
+        assert f.read(len(tool.HEADER)) == tool.HEADER
@@ -0,0 +1,100 @@
+import configparser
+import io
+import os
+import sys
+import wsgiref.util
+
+import pytest
+
+bottle = pytest.importorskip('bottle')
+
+from conftest import ROOT  # noqa: E402
+from modules import metrics  # noqa: E402
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(metrics, '_enabled', True)
+    monkeypatch.setattr(metrics, '_values', {})
+    monkeypatch.setattr(metrics, '_collectors', {})
+
+
+def _lines(text, name):
+    return [line for line in text.splitlines() if line.startswith(name)]
+
+
+def test_disabled_records_nothing(monkeypatch):
+    monkeypatch.setattr(metrics, '_values', {})
+    conf = configparser.ConfigParser()
+    conf['bottle'] = {'metrics_enabled': 'False'}
+    metrics.configure(conf)
+    metrics.inc('pbin_captcha_total', outcome='ok')
+    metrics.observe('pbin_paste_bytes', 10)
+    with metrics.stage('render'):
+        pass
+    assert metrics._values == {}
+    assert not metrics.enabled()
+
+
+def test_exposition(enabled):
+    metrics.inc('pbin_captcha_total', outcome='ok')
+    metrics.inc('pbin_captcha_total', 2, outcome='ok')
+    metrics.hit('render', False)
+    for size in (100, 300, 2000000):
+        metrics.observe('pbin_paste_bytes', size)
+    metrics.register('pbin_relay_queue_depth', 'gauge', 'Messages waiting.', lambda: [({}, 4)])
+    text = metrics.exposition()
+
+    assert '# HELP pbin_captcha_total Captcha verifications, by outcome.\n' in text
+    assert '# TYPE pbin_paste_bytes histogram\n' in text
+    assert _lines(text, 'pbin_captcha_total{') == ['pbin_captcha_total{outcome="ok"} 3']
+    assert _lines(text, 'pbin_cache_total{') == ['pbin_cache_total{cache="render",result="miss"} 1']
+    buckets = _lines(text, 'pbin_paste_bytes_bucket')
+    assert buckets[0] == 'pbin_paste_bytes_bucket{le="256"} 1'
+    assert buckets[1] == 'pbin_paste_bytes_bucket{le="1024"} 2'
+    assert buckets[-1] == 'pbin_paste_bytes_bucket{le="+Inf"} 3'
+    assert _lines(text, 'pbin_paste_bytes_sum') == ['pbin_paste_bytes_sum 2000400']
+    assert _lines(text, 'pbin_paste_bytes_count') == ['pbin_paste_bytes_count 3']
+    assert text.endswith('# TYPE pbin_relay_queue_depth gauge\npbin_relay_queue_depth 4\n')
+
+
+def test_label_values_are_escaped(enabled):
+    metrics.inc('pbin_captcha_total', outcome='say "hi"\\\n')
+    assert _lines(metrics.exposition(), 'pbin_captcha_total{') == [
+        'pbin_captcha_total{outcome="say \\"hi\\"\\\\\\n"} 1']
+
+
+def test_plugin_times_routes(enabled):
+    app = bottle.Bottle()
+    app.install(metrics.Plugin())
+    app.route('/p/<paste_id>', callback=lambda paste_id: paste_id)
+    app({'REQUEST_METHOD': 'GET', 'PATH_INFO': '/p/abc', 'wsgi.input': io.BytesIO()},
+        lambda status, headers, exc_info=None: None)
+    assert _lines(metrics.exposition(), 'pbin_request_seconds_count') == [
+        'pbin_request_seconds_count{method="GET",route="/p/<paste_id>"} 1']
+
+
+def test_metrics_route_is_off_by_default(tmp_path, monkeypatch):
+    fakeredis = pytest.importorskip('fakeredis')
+    pytest.importorskip('cymruwhois')
+    pytest.importorskip('jinja2')
+    from modules import store
+
+    (tmp_path / 'conf').mkdir()
+    (tmp_path / 'conf' / 'settings.cfg').write_text(
+        '[bottle]\nroot_path={}\nrelay_enabled=False\nprerender_workers=0\n'.format(os.path.abspath(ROOT)))
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(bottle, 'TEMPLATE_PATH', [os.path.join(ROOT, 'views')])
+    # Undo what importing app.py sets up globally
+    monkeypatch.setitem(bottle.BaseTemplate.defaults, 'asset', None)
+    monkeypatch.setattr(metrics, '_collectors', {})
+    monkeypatch.setattr(store, 'connect', lambda conf: fakeredis.FakeStrictRedis())
+    monkeypatch.delitem(sys.modules, 'app', raising=False)
+    import app
+
+    environ = {'PATH_INFO': '/metrics'}
+    wsgiref.util.setup_testing_defaults(environ)
+    status = []
+    app.app(environ, lambda code, headers, exc_info=None: status.append(code))
+    assert status == ['404 Not Found']
+    sys.modules.pop('app')
@@ -0,0 +1,84 @@
+import configparser
+import os
+
+import pytest
+
+bottle = pytest.importorskip('bottle')
+pytest.importorskip('cymruwhois')
+pytest.importorskip('requests')
+fakeredis = pytest.importorskip('fakeredis')
+pytest.importorskip('lupa')
+
+from conftest import ROOT  # noqa: E402
+from modules import ratelimit  # noqa: E402
+from modules import sanity  # noqa: E402
+from modules import utils  # noqa: E402
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    conf = configparser.ConfigParser()
+    conf['bottle'] = {'ratelimit_post': '2/60', 'ratelimit_view': '', 'ratelimit_diff': ''}
+    ratelimit.configure(conf)
+    monkeypatch.setattr(ratelimit, '_bucket_script', None)
+    monkeypatch.setattr(sanity, '_subnet_table', None)
+    monkeypatch.setattr(sanity, '_whois_fallback', True)
+    monkeypatch.setattr(sanity, '_whois_subnet', lambda addr: '203.0.113.0/24')
+    monkeypatch.setattr(sanity, '_subnet_cache', utils.LRUCache(maxsize=8, ttl=60))
+    monkeypatch.setattr(bottle, 'TEMPLATE_PATH', [os.path.join(ROOT, 'views')])
+    monkeypatch.setitem(bottle.BaseTemplate.defaults, 'asset', lambda name: '/static/' + name)
+    yield fakeredis.FakeStrictRedis()
+    ratelimit._limits.clear()
+
+
+def _post(cache, addr):
+    bottle.request.bind({'REQUEST_METHOD': 'POST', 'REMOTE_ADDR': addr})
+    try:
+        ratelimit.check(cache, 'post')
+    except bottle.HTTPResponse as e:
+        return e
+    return None
+
+
+def test_bucket_runs_out_and_sets_retry_after(cache):
+    assert _post(cache, '203.0.113.5') is None
+    assert _post(cache, '203.0.113.5') is None
+    response = _post(cache, '203.0.113.5')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) == 30
+    # Other addresses and unlimited routes are unaffected
+    assert _post(cache, '203.0.113.6') is None
+    bottle.request.bind({'REQUEST_METHOD': 'GET', 'REMOTE_ADDR': '203.0.113.5'})
+    ratelimit.check(cache, 'view')
+
+
+def test_bucket_does_not_depend_on_the_subnet_cache(cache):
+    assert _post(cache, '203.0.113.5') is None
+    # Another process, or this one after the lookup expired, knows the subnet
+    sanity.address_digest('203.0.113.5')
+    assert _post(cache, '203.0.113.5') is None
+    assert _post(cache, '203.0.113.5').status_code == 429
+
+
+def test_ipv6_clients_share_their_64(cache):
+    assert _post(cache, '2001:db8::1') is None
+    assert _post(cache, '2001:db8::2') is None
+    assert _post(cache, '2001:db8::3').status_code == 429
+    assert _post(cache, '2001:db8:0:1::1') is None
+
+
+def test_whitelisted_address_is_exempt_without_its_subnet_cached(cache, monkeypatch):
+    assert sanity.whitelist_address(cache, '203.0.113.5')
+    monkeypatch.setattr(sanity, '_subnet_cache', utils.LRUCache(maxsize=8, ttl=60))
+    for _ in range(5):
+        assert _post(cache, '203.0.113.5') is None
+
+    # Its subnet is exempt wherever the subnet is known
+    sanity.address_digest('203.0.113.9')
+    for _ in range(5):
+        assert _post(cache, '203.0.113.9') is None
+
+    assert sanity.greylist_address(cache, '203.0.113.5')
+    assert _post(cache, '203.0.113.5') is None
+    assert _post(cache, '203.0.113.5') is None
+    assert _post(cache, '203.0.113.5').status_code == 429
@@ -0,0 +1,51 @@
+import gzip
+
+import pytest
+
+pytest.importorskip('bottle')
+pytest.importorskip('redis')
+fakeredis = pytest.importorskip('fakeredis')
+
+from modules import render  # noqa: E402
+
+
+def _cache():
+    cache = fakeredis.FakeStrictRedis()
+    cache.hset('paste:abc', 'code', 'x')
+    cache.expire('paste:abc', 3600)
+    return cache
+
+
+def test_tiny_page_is_served_in_the_requested_encoding():
+    cache = _cache()
+    (body, encoding) = render.get_page(cache, 'abc', 'v1', 'gzip', lambda: 'hi')
+    assert encoding == 'gzip'
+    assert gzip.decompress(body) == b'hi'
+    assert cache.hget('page:abc:v1', 'identity') == b'hi'
+
+
+def test_missing_variant_is_added_to_a_cached_page():
+    cache = _cache()
+    cache.hset('page:abc:v1', 'identity', b'stored')
+
+    def build():
+        raise AssertionError('page was cached')
+    (body, encoding) = render.get_page(cache, 'abc', 'v1', 'gzip', build)
+    assert encoding == 'gzip'
+    assert gzip.decompress(body) == b'stored'
+    assert gzip.decompress(cache.hget('page:abc:v1', 'gzip')) == b'stored'
+
+
+def test_rendered_html_is_kept_briefly():
+    cache = _cache()
+    html = render.get_rendered(cache, 'abc', 'listen 80;\n', 'nginx')
+    assert cache.get('render:abc').decode('utf-8') == html
+    assert 0 < cache.ttl('render:abc') <= render.RENDER_TTL < cache.ttl('paste:abc')
+
+
+def test_waiter_renders_itself_when_the_first_view_is_stuck(monkeypatch):
+    cache = _cache()
+    monkeypatch.setattr(render, 'LOCK_TTL', 0.01)
+    monkeypatch.setitem(render._inflight, 'abc', render.concurrent.futures.Future())
+    html = render.get_rendered(cache, 'abc', 'listen 80;\n', 'nginx')
+    assert 'nginx.org/r/listen' in html
@@ -0,0 +1,63 @@
+import io
+
+import pytest
+
+bottle = pytest.importorskip('bottle')
+pytest.importorskip('cymruwhois')
+pytest.importorskip('requests')
+
+from modules import sanity  # noqa: E402
+from modules import utils  # noqa: E402
+
+
+def _bind(headers, body=b''):
+    environ = {'REQUEST_METHOD': 'POST', 'wsgi.input': io.BytesIO(body)}
+    environ.update(headers)
+    bottle.request.bind(environ)
+
+
+def test_declared_size_within_limit():
+    _bind({'CONTENT_LENGTH': '100'})
+    assert sanity.request_size_error() is None
+
+
+def test_declared_size_over_limit():
+    _bind({'CONTENT_LENGTH': str(bottle.request.MEMFILE_MAX + 1)})
+    assert 'ERR:991' in sanity.request_size_error()
+
+
+def test_chunked_and_undeclared_bodies_are_refused():
+    _bind({'HTTP_TRANSFER_ENCODING': 'chunked'})
+    assert 'ERR:993' in sanity.request_size_error()
+    _bind({})
+    assert 'ERR:993' in sanity.request_size_error()
+
+
+class _Upload(object):
+    def __init__(self, data):
+        self.file = io.BytesIO(data)
+
+
+def test_read_upload_limits_and_decodes():
+    assert sanity.read_upload(_Upload('héllo'.encode('utf-8')), 100, chunk_size=2) == ('héllo', None)
+    assert 'ERR:992' in sanity.read_upload(_Upload(b'x' * 101), 100)[1]
+    assert 'ERR:281' in sanity.read_upload(_Upload(b'\xff\xfe'), 100)[1]
+
+
+def test_address_digest_can_skip_whois(monkeypatch):
+    asked = []
+
+    def whois(addr):
+        asked.append(addr)
+        return '203.0.113.0/24'
+    monkeypatch.setattr(sanity, '_whois_subnet', whois)
+    monkeypatch.setattr(sanity, '_whois_fallback', True)
+    monkeypatch.setattr(sanity, '_subnet_table', None)
+    monkeypatch.setattr(sanity, '_subnet_cache', utils.LRUCache(maxsize=8, ttl=60))
+
+    assert sanity.address_digest('203.0.113.5', whois=False) is None
+    assert asked == []
+    digest = sanity.address_digest('203.0.113.5')
+    assert asked == ['203.0.113.5']
+    # Found through the cache from now on
+    assert sanity.address_digest('203.0.113.5', whois=False) == digest
@@ -0,0 +1,143 @@
+import configparser
+
+import pytest
+
+redis = pytest.importorskip('redis')
+fakeredis = pytest.importorskip('fakeredis')
+
+from modules import store  # noqa: E402
+
+
+def _client():
+    return fakeredis.FakeStrictRedis(server=fakeredis.FakeServer())
+
+
+class _Down(object):
+    '''
+    A replica that cannot be reached.
+    '''
+    calls = 0
+
+    def __getattr__(self, name):
+        def fail(*args):
+            self.calls += 1
+            raise redis.exceptions.ConnectionError('down')
+        return fail
+
+
+def _conf(**settings):
+    conf = configparser.ConfigParser()
+    conf['bottle'] = {
+        'cache_host': 'localhost', 'cache_port': '6379', 'cache_socket': '',
+        'cache_password': '', 'cache_db': '0', 'cache_pool_size': '7',
+        'cache_connect_timeout': '1', 'cache_timeout': '2',
+        'cache_replica_host': '', 'cache_replica_port': '6379'}
+    conf['bottle'].update(settings)
+    return conf
+
+
+def test_connect_uses_a_bounded_pool(monkeypatch):
+    monkeypatch.setattr(store, '_replica', None)
+    pool = store.connect(_conf()).connection_pool
+    assert isinstance(pool, redis.BlockingConnectionPool)
+    assert pool.max_connections == 7
+    assert pool.connection_kwargs['socket_timeout'] == 2
+
+    pool = store.connect(_conf(cache_socket='/run/redis.sock')).connection_pool
+    assert pool.connection_class is redis.UnixDomainSocketConnection
+    assert pool.connection_kwargs['path'] == '/run/redis.sock'
+
+    store.connect(_conf(cache_replica_host='replica.invalid'))
+    assert store._replica.connection_pool.connection_kwargs['host'] == 'replica.invalid'
+
+
+def test_reads_go_to_the_replica_first(monkeypatch):
+    (primary, replica) = (_client(), _client())
+    monkeypatch.setattr(store, '_replica', replica)
+    monkeypatch.setattr(store, '_replica_retry', 0)
+    replica.hset('paste:abc', 'code', 'from replica')
+    primary.hset('paste:abc', 'code', 'from primary')
+    primary.hset('paste:new', 'code', 'not replicated yet')
+
+    assert store.get_field(primary, 'abc', 'code') == 'from replica'
+    assert store.get_field(primary, 'new', 'code') == 'not replicated yet'
+    assert store.get_field(primary, 'gone', 'code') is store.MISSING
+
+
+def test_unreachable_replica_is_skipped_for_a_while(monkeypatch):
+    primary = _client()
+    replica = _Down()
+    monkeypatch.setattr(store, '_replica', replica)
+    monkeypatch.setattr(store, '_replica_retry', 0)
+    primary.hset('paste:abc', 'code', 'from primary')
+
+    assert store.get_field(primary, 'abc', 'code') == 'from primary'
+    assert store.get_field(primary, 'abc', 'code') == 'from primary'
+    assert replica.calls == 1
+
+
+def test_create_and_read_back(monkeypatch):
+    pytest.importorskip('lupa')
+    monkeypatch.setattr(store, '_replica', None)
+    cache = _client()
+    code = 'server {\n    listen 80;\n}\n' * 100
+    paste_id = store.create(cache, {'code': code, 'name': 'me', 'syntax': 'nginx', 'bogus': 1}, 4)
+
+    paste = store.get(cache, paste_id)
+    assert (paste.code, paste.name, paste.syntax) == (code, 'me', 'nginx')
+    assert store.get_stored_code(cache, paste_id)[1] == store.FORMAT_ZLIB
+    assert 0 < cache.ttl('paste:' + paste_id) <= store.PASTE_TTL
+    assert store.delete(cache, paste_id) == []
+    assert store.get(cache, paste_id) is store.MISSING
+
+
+def test_id_length_grows_after_collisions(monkeypatch):
+    pytest.importorskip('lupa')
+    monkeypatch.setattr(store, '_replica', None)
+    monkeypatch.setattr(store, '_extra_length', {})
+    # Every id of a length is the same, so each one can be used only once
+    monkeypatch.setattr(store.os, 'urandom', lambda n: b'\0' * n)
+    cache = _client()
+
+    assert store.create(cache, {'code': 'a'}, 1) == '00'
+    assert store._extra_length == {}
+    # All three tries at the requested length collide
+    assert store.create(cache, {'code': 'b'}, 1) == '0000'
+    assert store._extra_length == {1: 1}
+    # So do the shorter probe and the tries one byte longer
+    assert store.create(cache, {'code': 'c'}, 1) == '000000'
+    assert store._extra_length == {1: 2}
+
+    # Once the short ids are free again the length shrinks back
+    cache.delete('paste:0000')
+    assert store.create(cache, {'code': 'd'}, 1) == '0000'
+    assert store._extra_length == {1: 1}
+
+
+def test_ids_never_collide(monkeypatch):
+    pytest.importorskip('lupa')
+    monkeypatch.setattr(store, '_replica', None)
+    monkeypatch.setattr(store, '_extra_length', {})
+    cache = _client()
+    # More pastes than one byte ids
+    ids = [store.create(cache, {'code': str(n)}, 1) for n in range(400)]
+    assert len(set(ids)) == len(ids)
+    assert [store.get_field(cache, paste_id, 'code') for paste_id in ids] == [str(n) for n in range(400)]
+    assert max(len(paste_id) for paste_id in ids) > 2
+    assert store._extra_length[1] > 0
+
+
+def test_lock_is_only_released_by_its_owner():
+    pytest.importorskip('lupa')
+    cache = _client()
+    token = store.acquire_lock(cache, 'renderlock:abc', 30)
+    assert token
+    assert store.acquire_lock(cache, 'renderlock:abc', 30) is None
+
+    # The lock expired and another process took it
+    cache.delete('renderlock:abc')
+    other = store.acquire_lock(cache, 'renderlock:abc', 30)
+    assert not store.release_lock(cache, 'renderlock:abc', token)
+    assert cache.get('renderlock:abc').decode('utf-8') == other
+    assert store.release_lock(cache, 'renderlock:abc', other)
+    assert not cache.exists('renderlock:abc')
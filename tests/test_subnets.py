@@ -0,0 +1,49 @@
+import os
+
+from conftest import FIXTURES
+from modules import subnets
+from modules import utils
+
+
+def _table():
+    return subnets.load(os.path.join(FIXTURES, 'pfx2as.txt'))
+
+
+def test_load_skips_comments_and_bad_lines():
+    assert len(_table()) == 7
+
+
+def test_lookup_longest_prefix():
+    table = _table()
+    assert table.lookup('198.51.100.7') == '198.51.100.0/24'
+    assert table.lookup('198.51.102.7') == '198.51.100.0/22'
+    assert table.lookup('192.0.2.200') == '192.0.2.0/24'
+    assert table.lookup('10.200.1.1') == '10.0.0.0/8'
+
+
+def test_lookup_ipv6_and_mapped():
+    table = _table()
+    assert table.lookup('2001:db8:1::5') == '2001:db8:1::/48'
+    assert table.lookup('2001:db8:ffff::5') == '2001:db8::/32'
+    assert table.lookup('::ffff:192.0.2.9') == '192.0.2.0/24'
+
+
+def test_lookup_miss():
+    table = _table()
+    assert table.lookup('8.8.8.8') is None
+    assert table.lookup('2001:db9::1') is None
+    assert table.lookup('undef') is None
+
+
+def test_lru_cache_evicts_and_expires():
+    cache = utils.LRUCache(maxsize=2, ttl=3600)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+
+    expired = utils.LRUCache(maxsize=2, ttl=-1)
+    expired.set('a', 1)
+    assert expired.get('a') is None
@@ -0,0 +1,44 @@
+from modules import syntax
+
+NGINX = 'server {\n    listen 80;\n    location / {\n        proxy_pass http://backend;\n    }\n}\n'
+
+
+def test_nginx_directives_are_linked():
+    html = syntax.render(NGINX, 'nginx')
+    assert '<a href="https://nginx.org/r/proxy_pass" target="_blank">proxy_pass</a>' in html
+    assert '<a href="https://nginx.org/r/listen" target="_blank">listen</a>' in html
+    assert html.count('class="linecount"') == NGINX.count('\n')
+
+
+def test_html_tags_are_linked_and_escaped():
+    html = syntax.render('<div class="a">&amp;</div>\n', 'html')
+    assert '<a href="https://www.w3schools.com/tags/tag_div.asp" target="_blank">div</a>' in html
+    assert '&amp;amp;' in html
+
+
+def test_unlinked_syntax():
+    assert '<a href' not in syntax.render(NGINX, 'text')
+
+
+def test_private_use_characters_in_code():
+    html = syntax.render('listen 80;\n# \ue0000\ue001 <b>\n', 'nginx')
+    assert '<a href="https://nginx.org/r/listen" target="_blank">listen</a>' in html
+    assert '\ue0000\ue001 &lt;b&gt;' in html
+
+
+def test_lines_match_pygments_without_links():
+    from pygments import highlight
+    from pygments.formatters import HtmlFormatter
+
+    class Stock(syntax.HtmlLineFormatter):
+        def _format_lines(self, tokensource):
+            return HtmlFormatter._format_lines(self, tokensource)
+
+    code = 'x = "<a>"\n\n  s = """doc\nstring"""  \nprint(x)'
+    stock = highlight(code, syntax.get_lexer('python'), Stock(linenos=True, cssclass='paste'))
+    assert highlight(code, syntax.get_lexer('python'), syntax.get_formatter()) == stock
+
+
+def test_unknown_syntax_is_text():
+    assert syntax.normalize('cobol') == 'text'
+    assert syntax.get_lexer('cobol').name == syntax.get_lexer('text').name
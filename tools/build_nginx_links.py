@@ -0,0 +1,63 @@
+#!/usr/bin/env python
+'''
+Rebuild modules/kwlinker/nginx.links from the nginx.org directive and variable indexes.
+
+The file is maintained by hand; review the diff after a rebuild, as entries
+added by hand are dropped if nginx.org does not list them.
+
+    python tools/build_nginx_links.py [--dirindex FILE] [--varindex FILE]
+
+Without arguments the indexes are downloaded from nginx.org.
+'''
+
+import argparse
+import os
+import re
+import urllib.request
+
+DOCS = 'https://nginx.org/en/docs/'
+OUTPUT = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                      '..', 'modules', 'kwlinker', 'nginx.links')
+
+# Also the header of the checked in file, which must stay the same
+HEADER = ('# Maintained by hand; tools/build_nginx_links.py can rebuild it from nginx.org.\n'
+          '# <name> <url>; variables ending in _ are prefixes such as $arg_name.\n')
+
+_directive = re.compile(r'<a href="[^"#]+#([a-z0-9_]+)">\1</a>')
+_variable = re.compile(r'<a href="([^"#]+)#var_([a-z0-9_]+)">')
+
+
+def fetch(source, name):
+    if source:
+        with open(source, encoding='utf-8') as f:
+            return f.read()
+    with urllib.request.urlopen(DOCS + name) as resp:
+        return resp.read().decode('utf-8')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--dirindex', help='local copy of dirindex.html')
+    parser.add_argument('--varindex', help='local copy of varindex.html')
+    parser.add_argument('--output', default=OUTPUT)
+    args = parser.parse_args()
+
+    directives = sorted(set(_directive.findall(fetch(args.dirindex, 'dirindex.html'))))
+
+    # The same variable can be documented by several modules; keep the first (http)
+    variables = {}
+    for (page, name) in _variable.findall(fetch(args.varindex, 'varindex.html')):
+        variables.setdefault(name, '{}{}#var_{}'.format(DOCS, page, name))
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        f.write(HEADER)
+        for name in directives:
+            f.write('{}\thttps://nginx.org/r/{}\n'.format(name, name))
+        for name in sorted(variables):
+            f.write('${}\t{}\n'.format(name, variables[name]))
+
+    print('{} directives, {} variables'.format(len(directives), len(variables)))
+
+
+if __name__ == '__main__':
+    main()